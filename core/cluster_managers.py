@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 import logging
+import random
 from abc import ABCMeta, abstractmethod
+from bisect import bisect_left, bisect_right
 from util import delta
 
 
@@ -9,16 +11,60 @@ from util import delta
 """
 
 
+class _FailedJobs(object):
+	"""
+	The CPUs and time limits of the jobs that couldn't be fitted
+	in the backfilling window during the current session.
+
+	Only the pairs not dominated by others are kept, sorted by
+	the CPUs (the time limits are then in the decreasing order).
+	"""
+
+	def __init__(self):
+		self._procs = []
+		self._limits = []
+
+	def clear(self):
+		self._procs = []
+		self._limits = []
+
+	def dominates(self, job):
+		"""
+		Check if a job with at most as many CPUs and at most
+		as long time limit already failed.
+		"""
+		i = bisect_right(self._procs, job.proc)
+		return i > 0 and self._limits[i - 1] <= job.time_limit
+
+	def add(self, job):
+		"""
+		Add the job that failed to fit.
+		"""
+		if self.dominates(job):
+			return
+		i = j = bisect_left(self._procs, job.proc)
+		# the pairs dominated by the job are right after it
+		while j < len(self._limits) and self._limits[j] >= job.time_limit:
+			j += 1
+		self._procs[i:j] = [job.proc]
+		self._limits[i:j] = [job.time_limit]
+
+
 class _NodeSpace(object):
 	"""
+	A single space of the `BaseManager` list.
 
+	The available and reserved CPUs are stored as the change
+	from the previous space (the first space stores the values).
 	"""
 
-	def __init__(self, begin, end, avail, reserved, next, job_ends):
+	def __init__(self, begin, end, avail_diff, rsrv_diff, prev, next,
+		     job_ends):
 		self.begin = begin
 		self.end = end
-		self.avail = avail
-		self.reserved = reserved
+		self.avail_diff = avail_diff
+		self.rsrv_diff = rsrv_diff
+		self.prev = prev
 		self.next = next
 		self.job_ends = job_ends
 		self.rsrv_starts = 0
@@ -28,15 +74,23 @@ class _NodeSpace(object):
 		self.length = self.end - self.begin
 
 	def __repr__(self):
-		s = '[{}, {}] last {} first {}\n\tavail {}\n\trsrvd {}'
+		s = '[{}, {}] last {} first {}\n\tavail diff {}\n\trsrvd diff {}'
 		return s.format(delta(self.begin), delta(self.end),
 			self.job_ends, self.rsrv_starts,
-			self.avail, self.reserved)
+			self.avail_diff, self.rsrv_diff)
 
 
 class BaseManager(object):
 	"""
+	Keeps the future CPU availability as a doubly linked list of spaces.
 
+	The list is difference encoded: changing the available CPUs of
+	a range of spaces only updates the first space of the range and
+	the space after it. Together with the index of the last space of
+	each running job, the job resources are released in O(1) time.
+
+	The spaces changed in a session are remembered, so clearing
+	the reservations doesn't require walking the whole list.
 	"""
 
 	#__metaclass__ = ABCMeta
@@ -51,8 +105,13 @@ class BaseManager(object):
 					cpus,
 					0,
 					None,
+					None,
 					0,
 				   )
+		self._job_spaces = {}  # running job -> last space of the job
+		self._touched = []  # spaces changed in the current session
+		self._failed = _FailedJobs()
+		self.pruned = self.tested = 0
 		self._reservations = 0
 		self._cpu_limit = cpus
 		self._debug = logging.getLogger().isEnabledFor(logging.DEBUG)
@@ -63,8 +122,12 @@ class BaseManager(object):
 		"""
 		logging.debug(intro, *args)
 		it = self._space_list
+		avail = reserved = 0
 		while it is not None:
-			logging.debug('%s', it)
+			avail += it.avail_diff
+			reserved += it.rsrv_diff
+			logging.debug('%s\n\tavail %s\n\trsrvd %s',
+				      it, avail, reserved)
 			it = it.next
 
 	def runnable(self, job):
@@ -82,11 +145,29 @@ class BaseManager(object):
 
 		"""
 		self._window = now + self._settings.bf_window
+		self._failed.clear()
 		self._space_list.begin = now
 		self._space_list.update()
 		assert self._space_list.length > 0, 'some finished jobs not removed'
 		assert not self._reservations, 'reservations not removed'
 
+	def _unlink(self, space):
+		"""
+		Remove the space from the list, the next space takes its place.
+		"""
+		next = space.next
+		next.begin = space.begin
+		next.update()
+		# keep the values of the following spaces
+		next.avail_diff += space.avail_diff
+		next.rsrv_diff += space.rsrv_diff
+		next.prev = space.prev
+		if space.prev is None:
+			self._space_list = next
+		else:
+			space.prev.next = next
+		space.prev = space.next = None
+
 	def _allocate_resources(self, job, first, last, reservation):
 		"""
 		Allocate resources to the job and update the space list.
@@ -101,37 +182,49 @@ class BaseManager(object):
 		# The job spans the spaces from `first` to `last` (inclusive).
 		# However we might have to split the last one.
 		if (last.end - first.begin) > job.time_limit:
-			# Divide the `last` space appropriately and
-			# create a new space to occupy the gap.
+			# Divide the `last` space appropriately and create
+			# a new space before it to occupy the job part.
+			# The `last` space keeps the job ends, so the
+			# index of running jobs stays valid.
 			new_space = _NodeSpace(
+					last.begin,
 					first.begin + job.time_limit,
-					last.end,
-					last.avail,
-					last.reserved,
-					last.next,
-					last.job_ends,
+					last.avail_diff,
+					last.rsrv_diff,
+					last.prev,
+					last,
+					0,
 				    )
-			# new space is following `last`
-			last.end = new_space.begin
-			last.next = new_space
-			last.job_ends = 0
+			new_space.rsrv_starts = last.rsrv_starts
+			if last.prev is None:
+				self._space_list = new_space
+			else:
+				last.prev.next = new_space
+			last.prev = new_space
+			last.begin = new_space.end
+			last.avail_diff = last.rsrv_diff = 0
+			last.rsrv_starts = 0
 			last.update()
+			self._touched.append(new_space)
+			if first == last:
+				first = new_space
+			last = new_space
 
 		if not reservation:
 			last.job_ends += 1
+			self._job_spaces[job] = last
 		else:
 			first.rsrv_starts += 1
 			self._reservations += 1
 
 		# remove the used up resources
-		it = first
-		while True:
-			it.avail -= job.proc
-			if reservation:
-				it.reserved += job.proc
-			if it == last:
-				break
-			it = it.next
+		first.avail_diff -= job.proc
+		last.next.avail_diff += job.proc
+		if reservation:
+			first.rsrv_diff += job.proc
+			last.next.rsrv_diff -= job.proc
+			self._touched.append(first)
+			self._touched.append(last.next)
 
 		if self._debug:
 			self._dump_space('Added resources %s', job)
@@ -147,7 +240,7 @@ class BaseManager(object):
 		# This means we only have to check the first one
 		# to see if the job can be executed.
 		first = self._space_list
-		if job.proc > first.avail:
+		if job.proc > first.avail_diff:
 			return False
 
 		total_time = 0
@@ -165,19 +258,36 @@ class BaseManager(object):
 
 	def try_backfill(self, job):
 		"""
-		TODO
 		Make a reservation for the job.
 		Return if the job can be executed immediately.
+
+		The resources only decrease during a session, so a job is
+		rejected right away if a job with at most as many CPUs and
+		at most as long time limit already failed to fit.
+		"""
+		if self._failed.dominates(job):
+			self.pruned += 1
+			return False
+		self.tested += 1
+		return self._try_backfill(job)
+
+	def _try_backfill(self, job):
+		"""
+		TODO
+		The `try_backfill` implementation.
+		Add the job to `_failed` if it doesn't fit.
 		"""
 		total_time = 0
 		it = first = self._space_list
 
-		avail = it.avail
+		# available CPUs in the `first` and `it` spaces
+		first_avail = it_avail = it.avail_diff
+		avail = it_avail
 		must_check = True
 
 		while True:
 			if must_check:
-				avail = min(avail, it.avail)
+				avail = min(avail, it_avail)
 
 			if not must_check or job.proc <= avail:
 				total_time += it.length
@@ -186,16 +296,19 @@ class BaseManager(object):
 					break
 				# next space #TODO OPIS (dlaczego tak sie sprawdza must_check??)
 				it = it.next
+				it_avail += it.avail_diff
 				must_check = it.rsrv_starts > 0
 			else:
 				total_time = 0
 				#TODO OPIS
 				it = first = first.next
-				avail = it.avail
+				first_avail += first.avail_diff
+				avail = it_avail = first_avail
 				must_check = True
 				# Maybe we can stop, if the potential start is already
 				# outside of the backfilling window.
 				if first.begin > self._window:
+					self._failed.add(job)
 					return False
 
 		# check if the job can be executed now
@@ -210,26 +323,23 @@ class BaseManager(object):
 		Clear the created reservations.
 		"""
 		before = self._reservations
-		prev, it = None, self._space_list
 
-		while it.next is not None:
+		# Only the spaces changed in this session can have
+		# reservations or no job ends.
+		for it in self._touched:
 			# update the count
 			self._reservations -= it.rsrv_starts
 			it.rsrv_starts = 0
-			# now clean up
-			if not it.job_ends:
+			# give back the reserved resources
+			it.avail_diff += it.rsrv_diff
+			it.rsrv_diff = 0
+		for it in self._touched:
+			# now clean up, the removed spaces and
+			# the last space have no next space
+			if not it.job_ends and it.next is not None:
 				# we can safely remove this space
-				remove, it = it, it.next
-				it.begin = remove.begin
-				it.update()
-				#TODO DODAC JAKIES ASSERTY??
-				#TODO WYGLADA NA TO ZE REMOVE.AVAIL + REMOVE.RESERVED == IT.AVAIL??
-				prev.next = it
-				remove.next = None
-			else:
-				it.avail += it.reserved
-				it.reserved = 0
-				prev, it = it, it.next
+				self._unlink(it)
+		self._touched = []
 
 		assert not self._reservations, 'reservations not cleared'
 		if self._debug:
@@ -244,34 +354,513 @@ class BaseManager(object):
 		self._space_list.begin = job.end_time
 		self._space_list.update()
 		assert self._space_list.length >= 0, 'some finished jobs not removed'
-		#assert job.alloc is not None, 'missing job resources'
-		#TODO TEN ASSERT TERAZ POWINIEN SPRAWDZAC CZY PRACA JEST JUZ FINISHED (STARTED?)
 
-		last_space_end = job.start_time + job.time_limit
-		it = self._space_list
+		last = self._job_spaces.pop(job)
+		assert last.end == job.start_time + job.time_limit, \
+		  'missing job last space'
+		assert last.job_ends > 0, 'invalid last space'
+
+		# give back the resources from now to the last space
+		self._space_list.avail_diff += job.proc
+		last.next.avail_diff -= job.proc
+
+		if last.job_ends == 1:
+			# we can safely merge this space with the next one
+			assert not last.next.avail_diff, 'invalid resources'
+			self._unlink(last)
+		else:
+			last.job_ends -= 1
 
-		while it.end < last_space_end:
-			it.avail += job.proc
+		if self._debug:
+			self._dump_space('Removed resources %s', job)
+
+
+class EasyManager(BaseManager):
+	"""
+	A cluster manager with the EASY backfilling.
+
+	Only the first job that can't be started in a backfilling
+	pass gets a reservation, at the earliest time with enough
+	CPUs available (the shadow time). The other jobs are started
+	only if they end before the shadow time or use the CPUs that
+	are left over at the shadow time. If the shadow time is
+	outside of the backfilling window, no job is reserved in
+	that pass.
+
+	The reservation is not stored in the space list, so
+	the spaces are never split for the reservations.
+	"""
+
+	def start_session(self, now):
+		"""
+		Prepare the manager for the upcoming scheduling or backfilling pass.
+
+		Args:
+		  now: session start time
+
+		"""
+		BaseManager.start_session(self, now)
+		self._reserved = False  # if the first blocked job was found
+		self._shadow = None
+		self._extra = 0
+
+	def _reserve(self, job):
+		"""
+		Find the shadow time and the extra CPUs for the job.
+		"""
+		self._reserved = True
+		# Without reservations each space has more resources
+		# available than the spaces before it.
+		it = self._space_list
+		avail = it.avail_diff
+		while job.proc > avail:
 			it = it.next
+			avail += it.avail_diff
 
-		assert it.end == last_space_end, 'missing job last space'
-		assert it.job_ends > 0, 'invalid last space'
+		# the job won't be reserved outside of the backfilling window
+		if it.begin > self._window:
+			return
+		self._shadow = it.begin
+		self._extra = avail - job.proc
 
-		if it.job_ends == 1:
-			# we can safely merge this space with the next one
-			remove = it.next
-			it.end = remove.end
-			it.avail = remove.avail
-			#TODO TUTAJ TEZ ASSERT TYPE IT.AVAIL + JOB>PROC == REMOVE.AVAIL??
-			it.reserved = remove.reserved #TODO ASSERT RESERVVED == 0??
-			it.job_ends = remove.job_ends
-			it.update()
-			# move 'pointers' as the last step
-			it.next = remove.next
-			remove.next = None
+		if self._debug:
+			logging.debug('Shadow time %s extra %s for %s',
+				      delta(self._shadow), self._extra, job)
+
+	def _try_backfill(self, job):
+		"""
+		Start the job if it doesn't delay the reserved job.
+		Make the reservation for the first job that doesn't fit.
+		"""
+		if job.proc > self._space_list.avail_diff:
+			if not self._reserved:
+				self._reserve(job)
+			# the bigger jobs won't be reserved anymore
+			self._failed.add(job)
+			return False
+
+		if self._shadow is not None:
+			end = self._space_list.begin + job.time_limit
+			if end > self._shadow:
+				# the job will still run at the shadow time
+				if job.proc > self._extra:
+					self._failed.add(job)
+					return False
+				self._extra -= job.proc
+
+		return self.try_schedule(job)
+
+
+class _TreeSpace(object):
+	"""
+	A node of the `TreeManager` treap.
+
+	Each node is a space starting at `begin` and ending at the
+	`begin` of the next node. The `min_avail` is the lowest
+	`avail` in the subtree, `lazy` is a pending change of
+	`avail` for both children.
+	"""
+
+	__slots__ = ('begin', 'avail', 'min_avail', 'lazy', 'prio',
+		     'left', 'right')
+
+	def __init__(self, begin, avail, prio):
+		self.begin = begin
+		self.avail = avail
+		self.min_avail = avail
+		self.lazy = 0
+		self.prio = prio
+		self.left = None
+		self.right = None
+
+	def __repr__(self):
+		return '[{}, ...] avail {}'.format(delta(self.begin), self.avail)
+
+
+def _push(node):
+	"""
+	Pass the pending change of `avail` to the children.
+	"""
+	if node.lazy:
+		for child in (node.left, node.right):
+			if child is not None:
+				child.avail += node.lazy
+				child.min_avail += node.lazy
+				child.lazy += node.lazy
+		node.lazy = 0
+
+
+def _pull(node):
+	"""
+	Recalculate `min_avail` from the children.
+	"""
+	value = node.avail
+	if node.left is not None and node.left.min_avail < value:
+		value = node.left.min_avail
+	if node.right is not None and node.right.min_avail < value:
+		value = node.right.min_avail
+	node.min_avail = value
+
+
+def _split(node, begin):
+	"""
+	Split the treap into spaces starting before `begin` and the rest.
+	"""
+	if node is None:
+		return None, None
+	_push(node)
+	if node.begin < begin:
+		left, right = _split(node.right, begin)
+		node.right = left
+		_pull(node)
+		return node, right
+	else:
+		left, right = _split(node.left, begin)
+		node.left = right
+		_pull(node)
+		return left, node
+
+
+def _merge(left, right):
+	"""
+	Merge two treaps, all the spaces in `left` are the earlier ones.
+	"""
+	if left is None:
+		return right
+	if right is None:
+		return left
+	if left.prio > right.prio:
+		_push(left)
+		left.right = _merge(left.right, right)
+		_pull(left)
+		return left
+	else:
+		_push(right)
+		right.left = _merge(left, right.left)
+		_pull(right)
+		return right
+
+
+def _leftmost(node):
+	"""
+	Return the earliest space in the treap.
+	"""
+	_push(node)
+	while node.left is not None:
+		node = node.left
+		_push(node)
+	return node
+
+
+def _insert(node, space):
+	"""
+	Insert the `space` into the treap and return the new root.
+	"""
+	if node is None:
+		return space
+	if space.prio > node.prio:
+		space.left, space.right = _split(node, space.begin)
+		_pull(space)
+		return space
+	_push(node)
+	if space.begin < node.begin:
+		node.left = _insert(node.left, space)
+	else:
+		node.right = _insert(node.right, space)
+	_pull(node)
+	return node
+
+
+def _remove(node, begin):
+	"""
+	Remove the space starting at `begin` and return the new root.
+	"""
+	_push(node)
+	if node.begin == begin:
+		return _merge(node.left, node.right)
+	if begin < node.begin:
+		node.left = _remove(node.left, begin)
+	else:
+		node.right = _remove(node.right, begin)
+	_pull(node)
+	return node
+
+
+def _add_range(node, low, high, begin, end, value):
+	"""
+	Add `value` CPUs to the spaces starting in [begin, end).
+	All the spaces in the subtree start in [low, high).
+	"""
+	if node is None:
+		return
+	if begin <= low and high <= end:
+		# the whole subtree is in the range
+		node.avail += value
+		node.min_avail += value
+		node.lazy += value
+		return
+	_push(node)
+	if begin < node.begin:
+		_add_range(node.left, low, node.begin, begin, end, value)
+	if node.begin < end:
+		if begin <= node.begin:
+			node.avail += value
+		_add_range(node.right, node.begin, high, begin, end, value)
+	_pull(node)
+
+
+def _last_below(node, begin, end, proc):
+	"""
+	Return the begin of the last space starting in [begin, end)
+	with less than `proc` CPUs available, or `None`.
+	"""
+	while node is not None and node.min_avail < proc:
+		_push(node)
+		if node.begin >= end:
+			node = node.left
+		elif node.begin < begin:
+			node = node.right
+		else:
+			found = _last_below(node.right, begin, end, proc)
+			if found is not None:
+				return found
+			if node.avail < proc:
+				return node.begin
+			node = node.left
+	return None
+
+
+class TreeManager(BaseManager):
+	"""
+	A cluster manager with the same scheduling results as the
+	`BaseManager`, which keeps the spaces in a balanced tree
+	(a treap) instead of a list.
+
+	The tree supports adding CPUs to a range of spaces and finding
+	the lowest number of available CPUs in a range in O(log n) time.
+	This way each tested start of a job takes O(log n) time,
+	not depending on the number of the spaces in the job time limit.
+
+	Spaces are only identified by the begin time, the number of jobs
+	that end with each space is kept separately in `_job_ends`.
+
+	Note:
+	  Each tree operation costs much more than a step over the list,
+	  so this manager only pays off with several hundred spaces, that
+	  is running jobs with different ends. On the test traces it was
+	  about 2.5x faster with a few thousand running jobs, on par with
+	  about 300 and up to 2x slower with a few dozen.
+	"""
+
+	def __init__(self, cpus, settings):
+		self._settings = settings
+		# a fixed seed gives the same tree shape in each simulation
+		self._random = random.Random(0)
+		self._root = self._new_space(0, cpus)
+		self._job_ends = {}  # space end -> number of jobs
+		self._session_rsrv = []  # <begin, end, proc> of reservations
+		self._session_spaces = []  # begin of the spaces created
+		self._failed = _FailedJobs()
+		self.pruned = self.tested = 0
+		self._reservations = 0
+		self._cpu_limit = cpus
+		self._debug = logging.getLogger().isEnabledFor(logging.DEBUG)
+
+	def _new_space(self, begin, avail):
+		return _TreeSpace(begin, avail, self._random.random())
+
+	def _dump_space(self, intro, *args):
+		"""
+		Print the current state of node spaces.
+		"""
+		logging.debug(intro, *args)
+
+		def dump(node):
+			if node is not None:
+				_push(node)
+				dump(node.left)
+				logging.debug('%s last %s', node,
+					      self._job_ends.get(node.begin, 0))
+				dump(node.right)
+		dump(self._root)
+
+	def _first(self):
+		"""
+		Return the earliest space.
+		"""
+		return _leftmost(self._root)
+
+	def _find(self, t):
+		"""
+		Return the space containing the time `t`.
+		"""
+		node, found = self._root, None
+		while node is not None:
+			_push(node)
+			if node.begin <= t:
+				found, node = node, node.right
+			else:
+				node = node.left
+		return found
+
+	def _next_begin(self, t):
+		"""
+		Return the begin of the first space starting after `t`.
+		"""
+		node, found = self._root, float('inf')
+		while node is not None:
+			if node.begin > t:
+				found, node = node.begin, node.left
+			else:
+				node = node.right
+		return found
+
+	def _add_avail(self, begin, end, value):
+		"""
+		Add `value` CPUs to the spaces starting in [begin, end).
+		"""
+		_add_range(self._root, float('-inf'), float('inf'),
+			   begin, end, value)
+
+	def _add_space(self, t):
+		"""
+		Make sure a space starts at the time `t`.
+		Return if a new space was created.
+		"""
+		space = self._find(t)
+		if space.begin == t:
+			return False
+		new_space = self._new_space(t, space.avail)
+		self._root = _insert(self._root, new_space)
+		return True
+
+	def _remove_space(self, t):
+		"""
+		Merge the space starting at the time `t` with the previous one.
+		"""
+		assert self._find(t).begin == t, 'missing space'
+		self._root = _remove(self._root, t)
+
+	def _last_blocking(self, begin, end, proc):
+		"""
+		Return the begin of the last space starting in [begin, end)
+		with less than `proc` CPUs available, or `None`.
+		"""
+		return _last_below(self._root, begin, end, proc)
+
+	def start_session(self, now):
+		"""
+		Prepare the manager for the upcoming scheduling or backfilling pass.
+
+		Args:
+		  now: session start time
+
+		"""
+		self._window = now + self._settings.bf_window
+		self._failed.clear()
+		first = self._first()
+		assert self._next_begin(first.begin) > now, \
+		  'some finished jobs not removed'
+		first.begin = now
+		assert not self._reservations, 'reservations not removed'
+
+	def _allocate_resources(self, job, begin, reservation):
+		"""
+		Allocate resources to the job starting at `begin`.
+		"""
+		end = begin + job.time_limit
+
+		if self._add_space(end):
+			self._session_spaces.append(end)
+		self._add_avail(begin, end, -job.proc)
+
+		if not reservation:
+			self._job_ends[end] = self._job_ends.get(end, 0) + 1
+		else:
+			self._session_rsrv.append((begin, end, job.proc))
+			self._reservations += 1
+
+		if self._debug:
+			self._dump_space('Added resources %s', job)
+
+	def try_schedule(self, job):
+		"""
+		Start the job now if there are enough resources.
+		"""
+		assert not self._reservations, 'reservations are present'
+		# Without reservations the earliest space
+		# has the least resources available.
+		first = self._first()
+		if job.proc > first.avail:
+			return False
+
+		self._allocate_resources(job, first.begin, False)
+		return True
+
+	def _try_backfill(self, job):
+		"""
+		The `try_backfill` implementation.
+		Add the job to `_failed` if it doesn't fit.
+		"""
+		now = begin = self._first().begin
+
+		while True:
+			end = begin + job.time_limit
+			blocking = self._last_blocking(begin, end, job.proc)
+			if blocking is None:
+				break
+			# Every start up to the blocking space would include it.
+			# The last space always has all the CPUs available,
+			# so there is always a next space.
+			begin = self._next_begin(blocking)
+			if begin > self._window:
+				self._failed.add(job)
+				return False
+
+		can_run = (begin == now)
+
+		self._allocate_resources(job, begin, not can_run)
+		return can_run
+
+	def end_session(self):
+		"""
+		Clear the created reservations.
+		"""
+		before = self._reservations
+
+		for begin, end, proc in self._session_rsrv:
+			self._add_avail(begin, end, proc)
+			self._reservations -= 1
+		for t in self._session_spaces:
+			if t not in self._job_ends:
+				# no job ends here, the space is not needed
+				self._remove_space(t)
+
+		self._session_rsrv = []
+		self._session_spaces = []
+		assert not self._reservations, 'reservations not cleared'
+		if self._debug:
+			self._dump_space('Cleared %s reservations', before)
+
+	def job_ended(self, job):
+		"""
+		Free the resources taken by the job.
+		"""
+		assert not self._reservations, 'reservations are present'
+		assert self._next_begin(self._first().begin) >= job.end_time, \
+		  'some finished jobs not removed'
+
+		end = job.start_time + job.time_limit
+		assert self._job_ends.get(end, 0) > 0, 'missing job last space'
+
+		self._add_avail(float('-inf'), end, job.proc)
+
+		if self._job_ends[end] == 1:
+			# we can safely merge the spaces
+			del self._job_ends[end]
+			self._remove_space(end)
 		else:
-			it.avail += job.proc
-			it.job_ends -= 1
+			self._job_ends[end] -= 1
 
 		if self._debug:
 			self._dump_space('Removed resources %s', job)
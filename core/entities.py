@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+from collections import deque
 from util import delta
 
 
@@ -18,7 +19,8 @@ class Job(object):
 	  end_time: execution end time.
 	  started: job state.
 	  completed: job state.
-	  camp: `Campaign` instance to which the job belongs to.
+	  camp: `Campaign` instance to which the job belongs to
+	    (`None` after the campaign is released, see `User.release_completed`).
 
 	Correct usage scheme for each simulation:
 	  1) reset
@@ -30,13 +32,13 @@ class Job(object):
 	__slots__ = ('ID', 'submit', 'run_time', 'proc', 'user', 'time_limit',
 		     'camp', '_start', '_completed', 'estimate')
 
-	def __init__(self, stats, user):
-		self.ID = stats['job_id']
-		self.submit = stats['submit']
-		self.run_time = stats['run_time']
-		self.proc = stats['proc']
+	def __init__(self, ID, submit, run_time, proc, time_limit, user):
+		self.ID = ID
+		self.submit = submit
+		self.run_time = run_time
+		self.proc = proc
 		self.user = user
-		self.time_limit = stats['time_limit']
+		self.time_limit = time_limit
 
 	def reset(self):
 		self.camp = None
@@ -101,15 +103,15 @@ class Campaign(object):
 	  user: `User` instance.
 	  created: time the campaign was created.
 	  workload: predicted total execution time needed to finish the jobs.
-	  time_left: virtual time needed to fulfill the campaign workload.
-	  offset: virtual time needed to finish earlier created campaigns.
+	  time_left: virtual time needed to fulfill the campaign workload
+	    and the workload of the earlier created campaigns.
 	  active: campaign state in the virtual schedule.
-	  active_jobs: not finished jobs (pending or running).
+	  active_jobs: set of not finished jobs (pending or running).
 	  completed_jobs: jobs that finished execution, ordered by end time.
 
 	"""
 
-	__slots__ = ('ID', 'user', 'created', 'workload', '_virtual', '_offset',
+	__slots__ = ('ID', 'user', 'created', 'workload',
 		     'active_jobs', 'completed_jobs')
 
 	def __init__(self, id, user, time):
@@ -117,15 +119,12 @@ class Campaign(object):
 		self.user = user
 		self.created = time
 		self.workload = 0
-		self._virtual = 0
-		self._offset = 0
-		self.active_jobs = []
+		self.active_jobs = set()
 		self.completed_jobs = []
 
 	@property
 	def time_left(self):
-		# self._virtual is a float and we want an int
-		return self.workload - int(self._virtual) + self._offset
+		return self.user.time_left(self)
 
 	@property
 	def active(self):
@@ -134,7 +133,7 @@ class Campaign(object):
 	def add_job(self, job):
 		# until the job ends we can only use the estimate
 		self.workload += job.estimate * job.proc
-		self.active_jobs.append(job)
+		self.active_jobs.add(job)
 		job.camp = self # backward link
 
 	def job_started(self, job):
@@ -159,6 +158,47 @@ class Campaign(object):
 			len(self.active_jobs), len(self.completed_jobs))
 
 
+class RunTimeWindow(object):
+	"""
+	The run times of the last `size` completed jobs and their sum.
+
+	Attributes:
+	  size: the window size.
+	  total: the sum of the run times in the window.
+	  full: if there are `size` run times in the window.
+	"""
+
+	__slots__ = ('size', 'total', '_ring', '_pos', '_count')
+
+	def __init__(self, size):
+		self.size = size
+		self.total = 0
+		self._ring = [0] * size
+		self._pos = 0
+		self._count = 0
+
+	@property
+	def full(self):
+		return self._count == self.size
+
+	def add(self, run_time):
+		"""
+		Add the run time, the oldest one leaves the full window.
+		"""
+		if not self.size:
+			return
+		if self.full:
+			self.total -= self._ring[self._pos]
+		else:
+			self._count += 1
+		self._ring[self._pos] = run_time
+		self.total += run_time
+		self._pos = (self._pos + 1) % self.size
+
+	def __len__(self):
+		return self._count
+
+
 class User(object):
 	"""
 	A single user account with campaign lists and usage stats.
@@ -167,11 +207,16 @@ class User(object):
 	  ID: user ID, globally unique.
 	  shares: **NORMALIZED** share of the resources.
 	  active: state in the virtual schedule.
-	  cpu_clock_used: total usage, already accounting the decay.
-	  active_jobs: not finished jobs (pending or running).
+	  cpu_clock_used: total usage, already accounting the decay,
+	    in the simulator decay clock units (see `usage`).
+	  active_jobs: set of not finished jobs (pending or running).
 	  completed_jobs: jobs that finished execution, ordered by end time.
+	  recent_run_times: `RunTimeWindow` of the last completed jobs
+	    (see `set_run_time_window`).
 	  active_camps: active campaigns (see `Campaign`), ordered by creation time.
 	  completed_camps: completed campaigns, ordered by the virtual end time.
+	  released_jobs: number of completed jobs no longer kept.
+	  released_camps: number of completed campaigns no longer kept.
 
 	"""
 
@@ -181,17 +226,32 @@ class User(object):
 
 	def reset(self):
 		self._virt_pool = 0
+		self._virtual = 0
+		self._workloads = []  # binary indexed tree of camp workloads
+		self._total_workload = 0
 		self.lost_virtual = 0
 		self.last_active = None
 		self.false_inactivity = 0
 		self._occupied_cpus = 0
 		self.cpu_clock_used = 0
-		self.active_jobs = []
+		self._usage_clock = 0
+		self.active_jobs = set()
 		self.completed_jobs = []
-		self.active_camps = []
-		self.completed_camps = []
+		self.recent_run_times = RunTimeWindow(0)
+		self.active_camps = deque()
+		self.completed_camps = deque()
+		self.released_jobs = 0
+		self.released_camps = 0
 		self._camp_count = 0
 
+	@property
+	def completed_job_count(self):
+		return len(self.completed_jobs) + self.released_jobs
+
+	@property
+	def completed_camp_count(self):
+		return len(self.completed_camps) + self.released_camps
+
 	def add_virtual(self, value):
 		"""
 		Add the `value` long period to the virtual pool,
@@ -202,30 +262,73 @@ class User(object):
 	def virtual_work(self):
 		"""
 		Redistribute the accumulated virtual pool.
+
+		The campaigns are fulfilled in the creation order, so the
+		virtual time received is kept as a single value compared
+		with the prefix sums of the campaign workloads (see `time_left`).
 		"""
-		total = reduce(lambda x, y: x + y._virtual,
-			       self.active_camps, self._virt_pool)
-		prev = 0
-		for camp in self.active_camps:
-			virt = min(camp.workload, total)
-			total -= virt
-			camp._virtual = virt
-			camp._offset = prev
-			prev = camp.time_left
-		# overflow from total is lost
+		self._virtual += self._virt_pool
 		self._virt_pool = 0
-		self.lost_virtual += total
+		# overflow from the total workload is lost
+		if self._virtual > self._total_workload:
+			self.lost_virtual += self._virtual - self._total_workload
+			self._virtual = self._total_workload
+
+	def time_left(self, camp):
+		"""
+		Return the virtual time needed to fulfill the workload
+		of the campaign and the earlier created campaigns.
+		"""
+		# self._virtual is a float and we want an int
+		left = self._prefix_workload(camp.ID + 1) - int(self._virtual)
+		return max(left, 0)
+
+	def _prefix_workload(self, count):
+		"""
+		Return the total workload of the first `count` campaigns.
+		"""
+		total = 0
+		while count > 0:
+			total += self._workloads[count - 1]
+			count -= count & -count
+		return total
+
+	def _add_workload(self, camp, value):
+		"""
+		Add `value` to the workload of the campaign in the tree.
+		"""
+		i = camp.ID + 1
+		while i <= len(self._workloads):
+			self._workloads[i - 1] += value
+			i += i & -i
+		self._total_workload += value
+
+	def real_work(self, clock):
+		"""
+		Process the period up to the decay `clock` in the real schedule.
+		Must be called before the number of occupied CPUs changes.
+		"""
+		self.cpu_clock_used = self.usage(clock)
+		self._usage_clock = clock
 
-	def real_work(self, value, real_decay):
+	def usage(self, clock):
 		"""
-		Process the `value` long period in the real schedule.
-		Apply the decay factor `real_decay`.
+		Return the usage at the decay `clock`, without
+		changing the state of the user.
 		"""
-		self.cpu_clock_used += self._occupied_cpus * value
-		self.cpu_clock_used *= real_decay
+		return (self.cpu_clock_used + self._occupied_cpus *
+			(clock - self._usage_clock))
+
+	def rescale_usage(self, scale):
+		"""
+		Adjust the usage to a new decay epoch.
+		"""
+		self.cpu_clock_used *= scale
+		self._usage_clock *= scale
 
 	def add_job(self, job):
-		self.active_jobs.append(job)
+		self.active_jobs.add(job)
+		self._add_workload(job.camp, job.estimate * job.proc)
 
 	def job_started(self, job):
 		# we need to keep track of the number of processors
@@ -236,28 +339,65 @@ class User(object):
 		self._occupied_cpus -= job.proc
 		self.active_jobs.remove(job)
 		self.completed_jobs.append(job)
+		self.recent_run_times.add(job.run_time)
 		# The job estimated run time could be higher than the
-		# real run time, so we need redistribute the difference.
+		# real run time. The virtual time stays the same, so the
+		# difference goes to the next campaigns.
 		diff = (job.estimate - job.run_time) * job.proc
-		job.camp._virtual -= diff
-		self._virt_pool += diff
+		self._add_workload(job.camp, -diff)
 
 	def job_next_estimate(self, job, new_value):
-		if not job.camp in self.active_camps:
-			# This campaign has to be made active again.
-			# `camp.ID` corresponds to the location in the list.
-			loc = job.camp.ID
-			self.completed_camps, rest = (
-				self.completed_camps[:loc],
-				self.completed_camps[loc:]
-			)
-			self.active_camps = rest + self.active_camps
+		self._add_workload(job.camp, (new_value - job.estimate) * job.proc)
+		# `camp.ID` corresponds to the location in the list,
+		# counting the released campaigns.
+		loc = job.camp.ID - self.released_camps
+		if loc < len(self.completed_camps):
+			# This campaign has to be made active again,
+			# together with the campaigns completed after it.
+			while len(self.completed_camps) > loc:
+				camp = self.completed_camps.pop()
+				self.active_camps.appendleft(camp)
 			assert job.camp == self.active_camps[0], \
 			  'invalid campaign ordering'
 
+	def set_run_time_window(self, size):
+		"""
+		Keep the run times of the last `size` completed jobs.
+		"""
+		self.recent_run_times = RunTimeWindow(size)
+
+	def release_completed(self):
+		"""
+		Drop the completed jobs.
+		Drop and return the completed campaigns that can't change
+		anymore, the jobs are unlinked from these campaigns.
+
+		A completed campaign can't change if it has no active jobs,
+		the earlier campaigns can't change and it is not the newest
+		campaign (which can be made active again by the selector).
+		"""
+		released = []
+		while self.completed_camps:
+			camp = self.completed_camps[0]
+			if (camp.active_jobs or
+			    camp.ID == self._camp_count - 1):
+				break
+			self.completed_camps.popleft()
+			released.append(camp)
+		self.released_camps += len(released)
+
+		self.released_jobs += len(self.completed_jobs)
+		self.completed_jobs = []
+		return released
+
 	def create_campaign(self, time):
 		new_camp = Campaign(self._camp_count, self, time)
 		self._camp_count += 1
+		# the tree node of the new campaign covers the
+		# workloads of some previous campaigns
+		i = self._camp_count
+		self._workloads.append(self._prefix_workload(i - 1) -
+				       self._prefix_workload(i - (i & -i)))
 		self.active_camps.append(new_camp)
 		return new_camp
 
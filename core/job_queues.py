@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+import heapq
+import itertools
+from bisect import bisect_left, insort
+
+
+class WaitingQueue(object):
+	"""
+	Pending jobs ordered by the scheduler priority, the highest first.
+
+	The priority keys are cached between the scheduling passes.
+	Schedulers with `static_keys` only need the keys of the invalidated
+	users to be recomputed, otherwise all the keys are recomputed.
+	The built-in schedulers don't have static keys, so for them only
+	the cost of keeping the jobs ordered is reduced, not the number
+	of computed keys.
+
+	The jobs are kept in a list of sorted blocks, so adding and
+	removing a single job doesn't require moving the whole queue.
+
+	Correct usage scheme for each scheduling pass:
+	  1) refresh (optionally only the first `limit` jobs)
+	  2) iterate over the jobs
+	  3) remove the started jobs
+	"""
+
+	_LOAD = 256  # the preferred block length
+
+	def __init__(self, scheduler):
+		self._scheduler = scheduler
+		self._blocks = []  # lists of sorted entries
+		self._maxes = []  # the last entry from each block
+		self._entries = {}  # job -> <key, counter, job>
+		self._new = []  # jobs without a key, in the submission order
+		self._unordered = set()  # jobs left out by the partial refresh
+		self._stale = set()  # users with outdated keys
+		# Counter prevents the comparison of jobs,
+		# in case the keys are the same.
+		self._counter = itertools.count()
+
+	def add(self, job):
+		"""
+		Add the job to the queue.
+		The job is ordered after the next `refresh`.
+		"""
+		self._new.append(job)
+
+	def remove(self, job):
+		"""
+		Remove the job from the queue.
+		"""
+		entry = self._entries.pop(job, None)
+		if entry is None:
+			self._new.remove(job)
+		elif job in self._unordered:
+			self._unordered.remove(job)
+		else:
+			self._remove_entry(entry)
+
+	def invalidate(self, user):
+		"""
+		Mark the keys of the `user` jobs as outdated.
+		"""
+		self._stale.add(user)
+
+	def refresh(self, limit=None):
+		"""
+		Recompute the outdated keys.
+
+		If all the keys are recomputed and the `limit` is given,
+		only that many highest priority jobs are ordered and
+		the remaining jobs are skipped during the iteration.
+		"""
+		if not self._scheduler.static_keys:
+			self._rebuild(limit)
+			return
+
+		stale = set()
+		for user in self._stale:
+			for job in user.active_jobs:
+				if job in self._entries:
+					stale.add(job)
+		for job in stale:
+			self._remove_entry(self._entries[job])
+			self._insert_entry(self._new_entry(job))
+		for job in self._new:
+			self._insert_entry(self._new_entry(job))
+		self._new = []
+		self._stale.clear()
+
+	def peek(self):
+		"""
+		Return the highest priority job or `None`.
+		Jobs added after the last `refresh` are not considered.
+		"""
+		if self._blocks:
+			return self._blocks[0][0][-1]
+		return None
+
+	def _new_entry(self, job):
+		"""
+		Create a queue entry for the job with a fresh key.
+		The insertion order is kept between the same keys.
+		"""
+		prev = self._entries.get(job)
+		count = next(self._counter) if prev is None else prev[1]
+		entry = (self._scheduler.job_priority_key(job), count, job)
+		self._entries[job] = entry
+		return entry
+
+	def _rebuild(self, limit):
+		"""
+		Recompute all the keys and sort the entries again.
+		Select only the first `limit` entries if given.
+		"""
+		jobs = itertools.chain(self, self._unordered, self._new)
+		entries = map(self._new_entry, jobs)
+		if limit is not None and limit < len(entries):
+			# a partial selection is enough
+			entries = heapq.nsmallest(limit, entries)
+			self._unordered = set(self._entries)
+			self._unordered.difference_update(e[-1] for e in entries)
+		else:
+			entries.sort()
+			self._unordered = set()
+		size = self._LOAD
+		self._blocks = [entries[i:i+size]
+				for i in xrange(0, len(entries), size)]
+		self._maxes = [b[-1] for b in self._blocks]
+		self._new = []
+		self._stale.clear()
+
+	def _insert_entry(self, entry):
+		"""
+		Insert the entry into the appropriate block.
+		"""
+		if not self._blocks:
+			self._blocks.append([entry])
+			self._maxes.append(entry)
+			return
+
+		i = bisect_left(self._maxes, entry)
+		if i == len(self._maxes):
+			# the new last entry
+			i -= 1
+			self._blocks[i].append(entry)
+			self._maxes[i] = entry
+		else:
+			insort(self._blocks[i], entry)
+
+		block = self._blocks[i]
+		if len(block) > 2 * self._LOAD:
+			# split the block in half
+			half = len(block) >> 1
+			self._blocks.insert(i + 1, block[half:])
+			self._maxes.insert(i, block[half - 1])
+			del block[half:]
+
+	def _remove_entry(self, entry):
+		"""
+		Remove the entry from the block it is in.
+		"""
+		i = bisect_left(self._maxes, entry)
+		block = self._blocks[i]
+		j = bisect_left(block, entry)
+		assert block[j] is entry, 'entry not found'
+		del block[j]
+
+		if not block:
+			del self._blocks[i]
+			del self._maxes[i]
+		elif j == len(block):
+			self._maxes[i] = block[-1]
+
+	def __len__(self):
+		return len(self._entries) + len(self._new)
+
+	def __iter__(self):
+		"""
+		Iterate over the ordered jobs.
+		Jobs added after the last `refresh` or skipped
+		by a partial `refresh` are not considered.
+		"""
+		for block in self._blocks:
+			for entry in block:
+				yield entry[-1]
+
+
+class GroupedQueue(object):
+	"""
+	Pending jobs ordered by the scheduler priority, the highest first.
+
+	The jobs wait in separate queues for each group defined by the
+	scheduler (see `BaseScheduler.grouped_keys`), ordered by the
+	`in_group_key`. Only the keys of the groups are recomputed before
+	a scheduling pass and the group queues are merged lazily, so the
+	cost of a pass depends on the number of groups and the number
+	of jobs actually considered. With the `limit` of a partial refresh
+	only the groups holding the first `limit` jobs are merged.
+
+	The interface and the usage scheme are the same as in `WaitingQueue`.
+	"""
+
+	def __init__(self, scheduler):
+		self._scheduler = scheduler
+		self._groups = {}  # group -> list of sorted entries
+		self._keys = {}  # group -> group key
+		self._owners = {}  # user -> groups with the user jobs
+		self._entries = {}  # job -> <in-group key, counter, job>
+		self._stale = set()  # groups with outdated keys
+		self._limit = None  # of the jobs ordered by the last refresh
+		# Counter prevents the comparison of jobs,
+		# in case the keys are the same.
+		self._counter = itertools.count()
+
+	def add(self, job):
+		"""
+		Add the job to the queue.
+		The job is ordered after the next `refresh`.
+		"""
+		group = self._scheduler.job_group(job)
+		entry = (self._scheduler.in_group_key(job),
+			 next(self._counter), job)
+		self._entries[job] = entry
+
+		if group not in self._groups:
+			self._groups[group] = [entry]
+			self._owners.setdefault(job.user, set()).add(group)
+			self._stale.add(group)
+		else:
+			insort(self._groups[group], entry)
+
+	def remove(self, job):
+		"""
+		Remove the job from the queue.
+		"""
+		entry = self._entries.pop(job)
+		group = self._scheduler.job_group(job)
+		jobs = self._groups[group]
+		del jobs[bisect_left(jobs, entry)]
+
+		if not jobs:
+			del self._groups[group]
+			self._keys.pop(group, None)
+			self._stale.discard(group)
+			owned = self._owners[job.user]
+			owned.remove(group)
+			if not owned:
+				del self._owners[job.user]
+
+	def invalidate(self, user):
+		"""
+		Mark the keys of the `user` jobs as outdated.
+		"""
+		self._stale.update(self._owners.get(user, ()))
+
+	def refresh(self, limit=None):
+		"""
+		Recompute the outdated group keys.
+
+		If the `limit` is given, only that many highest priority
+		jobs are ordered and the remaining jobs are skipped during
+		the iteration.
+		"""
+		self._limit = limit
+		if not self._scheduler.static_keys:
+			self._stale = set(self._groups)
+		key = self._scheduler.group_priority_key
+		for group in self._stale:
+			self._keys[group] = key(group)
+		self._stale.clear()
+
+	def peek(self):
+		"""
+		Return the highest priority job or `None`.
+		Groups created after the last `refresh` are not considered.
+		"""
+		return next(iter(self), None)
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __iter__(self):
+		"""
+		Iterate over the ordered jobs.
+		Groups created after the last `refresh` are not considered.
+		"""
+		# heap of <key, counter, group key, group jobs, position>
+		heap = []
+		for group, jobs in self._groups.iteritems():
+			group_key = self._keys.get(group)
+			if group_key is not None:
+				key, count, _ = jobs[0]
+				heap.append((group_key + key, count, group_key, jobs, 0))
+		limit = self._limit
+		if limit is None:
+			limit = len(self._entries)
+		if limit < len(heap):
+			# the first `limit` jobs are in the groups with
+			# the first `limit` heads, a sorted list is a heap
+			heap = heapq.nsmallest(limit, heap)
+		else:
+			heapq.heapify(heap)
+
+		while heap and limit:
+			limit -= 1
+			_, _, group_key, jobs, pos = heap[0]
+			yield jobs[pos][-1]
+			pos += 1
+			if pos < len(jobs):
+				key, count, _ = jobs[pos]
+				heapq.heapreplace(heap, (group_key + key, count,
+							 group_key, jobs, pos))
+			else:
+				heapq.heappop(heap)
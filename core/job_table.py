@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+from entities import Job, User
+
+
+class JobTable(object):
+	"""
+	The jobs of a workload kept in NumPy arrays, one for each field.
+
+	The preprocessing of the workload works on the whole arrays.
+	The `Job` instances, which also keep the simulation state,
+	are only created for the simulated jobs (see `iter_jobs`).
+
+	Attributes:
+	  ID, submit, run_time, proc, time_limit: arrays with the job
+	    fields (see `Job`).
+	  user_id: array with the job owner IDs.
+	  users: a dictionary of `User` instances, keyed by the user ID.
+	"""
+
+	COLUMNS = ('ID', 'submit', 'run_time', 'proc', 'time_limit', 'user_id')
+	CHUNK = 10000  # number of rows converted together in `iter_jobs`
+
+	def __init__(self, users, **columns):
+		"""
+		Args:
+		  users: a dictionary of `User` instances.
+		  columns: a sequence of values for each of the `COLUMNS`.
+		"""
+		self.users = users
+		for name in self.COLUMNS:
+			setattr(self, name, np.asarray(columns[name], dtype=np.int64))
+		assert all(len(getattr(self, name)) == len(self.ID)
+			   for name in self.COLUMNS), 'invalid column length'
+
+	def take(self, index):
+		"""
+		Return a table with the selected jobs.
+
+		The `index` can be anything used for NumPy indexing
+		(a slice, a boolean mask, an array of positions).
+		Slices share the memory with this table.
+		"""
+		columns = {name: getattr(self, name)[index]
+			   for name in self.COLUMNS}
+		return JobTable(self.users, **columns)
+
+	def sort_by_submit(self):
+		"""
+		Return a table ordered by the submit time.
+		The order of the jobs submitted at the same time is kept.
+		"""
+		return self.take(np.argsort(self.submit, kind='mergesort'))
+
+	def save(self, filename):
+		"""
+		Store the table in a binary file, see `load`.
+		"""
+		data = np.vstack([getattr(self, name) for name in self.COLUMNS])
+		# write to a temporary file so a partial file is never loaded
+		temp = '{}.{}.tmp'.format(filename, os.getpid())
+		with open(temp, 'wb') as f:
+			np.save(f, data)
+		os.rename(temp, filename)
+
+	@classmethod
+	def load(cls, filename):
+		"""
+		Map a table stored by `save` into memory (read only).
+		New `User` instances are created for the table.
+		"""
+		data = np.load(filename, mmap_mode='r')
+		assert len(data) == len(cls.COLUMNS), 'invalid table file'
+		columns = dict(zip(cls.COLUMNS, data))
+		users = {uid: User(uid)
+			 for uid in np.unique(columns['user_id']).tolist()}
+		return cls(users, **columns)
+
+	def iter_jobs(self):
+		"""
+		Create a new `Job` instance for each job.
+		The instances are created lazily, a chunk of rows at a time.
+		"""
+		for start in xrange(0, len(self), self.CHUNK):
+			# plain integers are much faster in the simulation
+			rows = slice(start, start + self.CHUNK)
+			columns = [getattr(self, name)[rows].tolist()
+				   for name in self.COLUMNS]
+			for ID, submit, run_time, proc, limit, uid in zip(*columns):
+				job = Job(ID, submit, run_time, proc, limit,
+					  self.users[uid])
+				job.reset()
+				yield job
+
+	def __len__(self):
+		return len(self.ID)
@@ -3,9 +3,10 @@ import logging
 import os
 import sys
 import time
-from datetime import timedelta
+import numpy as np
 from abc import ABCMeta, abstractmethod
-from entities import Job, User
+from entities import User
+from job_table import JobTable
 
 
 class InvalidStatsError(Exception): pass
@@ -37,62 +38,147 @@ class BaseParser(object):
 	REQUIRED = ['job_id', 'submit', 'run_time', 'proc', 'user_id']
 	OPTIONAL = ['time_limit']
 
+	CHUNK = 100000  # number of lines parsed together
+
 	def parse_workload(self, filename, serial):
 		"""
 		Parse the file and create :mod: `entities` from the data.
 
+		The lines are parsed in chunks and the records are validated
+		and filtered for the whole chunk at once.
+
 		Args:
 		  filename: path to a workload file.
 		  serial: limit the number of CPUs to this value.
 
 		Returns:
-		  a list of `Jobs` already linked to `User` instances.
+		  a `JobTable` with the jobs.
 		  a dictionary of created `User` instances.
 		"""
-		self.jobs = []
-		self.users = {}
+		self._chunks = []  # the complete records from each chunk
+		self._ids = []  # all the job IDs from each chunk
 		skipped = 0
 
-		f = open(filename)
-		for i, line in enumerate(f):
-			if not line.strip():
-				continue
-			if not self._accept(line, i):
-				continue
-
-			stats = self._parse(line)
-			stats = self._validate(stats)
-
-			if stats['run_time'] <= 0 or stats['proc'] <= 0:
-				skipped += 1
-				continue  # skip incomplete data
-			if serial:
-				max_proc = min(stats['proc'], serial)
-				count = stats['proc'] / max_proc
-				assert count > 0, 'invalid job count'
-				stats['proc'] = max_proc
-			else:
-				count = 1
-
-			for i in range(count):
-				self._next_job(stats)
-		f.close()
+		with open(filename) as f:
+			lines = []
+			for i, line in enumerate(f):
+				if not line.strip():
+					continue
+				if not self._accept(line, i):
+					continue
+				lines.append(line)
+				if len(lines) == self.CHUNK:
+					skipped += self._add_records(self._parse_lines(lines))
+					lines = []
+			if lines:
+				skipped += self._add_records(self._parse_lines(lines))
+
+		jobs = self._create_table(serial)
+		self._chunks = self._ids = None
 
 		if skipped:
 			logging.warn('Skipped %s incomplete job records' % skipped)
 		logging.info('Parsing completed. Retrieved {} job records and {}'
-			     ' user records.'.format(len(self.jobs), len(self.users)))
-		return self.jobs, self.users
+			     ' user records.'.format(len(jobs), len(jobs.users)))
+		return jobs, jobs.users
+
+	def _parse_lines(self, lines):
+		"""
+		Parse the lines one by one with `_parse`.
+
+		Returns:
+		  a dictionary with an array of values for each field.
 
-	def _next_job(self, stats):
+		Raises `InvalidStatsError`.
 		"""
-		Add the job to the result list.
-		Replace the user id with a `User` instance.
+		names = self.REQUIRED + self.OPTIONAL
+		columns = {name: [] for name in names}
+
+		for line in lines:
+			stats = self._parse(line)
+			for name in self.REQUIRED:
+				if name not in stats:
+					msg = 'job {}: {} value is missing'
+					raise InvalidStatsError(msg.format(
+						stats.get('job_id'), name))
+			for name in names:
+				columns[name].append(stats.get(name, 0))
+
+		return {name: np.array(values, dtype=np.int64)
+			for name, values in columns.iteritems()}
+
+	def _add_records(self, records):
 		"""
-		uid = stats['user_id']
-		if uid not in self.users:
-			self.users[uid] = User(uid)
-		self.jobs.append( Job(stats, self.users[uid]) )
+		Validate a chunk of records and keep the complete ones.
+
+		Do the following:
+		  1) Check if the required values are non-negative.
+		  2) Change negative values to zero.
+		  3) Skip the records without a run time or CPUs.
+
+		Args:
+		  records: a dictionary with an array of values for each field.
+
+		Returns:
+		  the number of skipped records.
+
+		Raises `InvalidStatsError`.
+		"""
+		ids = records['job_id']
+
+		for name in ['job_id', 'user_id', 'submit']:
+			negative = np.flatnonzero(records[name] < 0)
+			if len(negative):
+				msg = 'job {}: {} has negative value'
+				raise InvalidStatsError(msg.format(ids[negative[0]], name))
+
+		self._ids.append(ids)
+
+		for values in records.itervalues():
+			np.maximum(values, 0, out=values)
+
+		complete = (records['run_time'] > 0) & (records['proc'] > 0)
+		self._chunks.append({name: values[complete]
+				     for name, values in records.iteritems()})
+		return len(ids) - np.count_nonzero(complete)
+
+	def _create_table(self, serial):
+		"""
+		Join the chunks, check the job IDs and split the jobs
+		with more than `serial` CPUs.
+
+		Raises `InvalidStatsError`.
+		"""
+		names = self.REQUIRED + self.OPTIONAL
+		if self._chunks:
+			records = {name: np.concatenate([c[name] for c in self._chunks])
+				   for name in names}
+			ids = np.sort(np.concatenate(self._ids))
+		else:
+			records = {name: np.zeros(0, dtype=np.int64) for name in names}
+			ids = records['job_id']
+
+		duplicate = ids[1:][ids[1:] == ids[:-1]]
+		if len(duplicate):
+			msg = 'job {}: duplicate ID number'.format(duplicate[0])
+			raise InvalidStatsError(msg)
+
+		if serial:
+			max_proc = np.minimum(records['proc'], serial)
+			count = records['proc'] // max_proc
+			assert np.all(count > 0), 'invalid job count'
+			records = {name: np.repeat(values, count)
+				   for name, values in records.iteritems()}
+			records['proc'] = np.repeat(max_proc, count)
+
+		users = {uid: User(uid) for uid in np.unique(records['user_id']).tolist()}
+		return JobTable(users,
+				ID=records['job_id'],
+				submit=records['submit'],
+				run_time=records['run_time'],
+				proc=records['proc'],
+				time_limit=records['time_limit'],
+				user_id=records['user_id'])
 
 	def _parse(self, line):
 		"""
@@ -118,43 +204,6 @@ class BaseParser(object):
 					values[i] = int(values[i])
 		return {name: values[field] for name, field in self.fields.iteritems() }
 
-	def _validate(self, stats, ids=set()):
-		"""
-		Do the following:
-		  1) Check if `stats` contain required values.
-		  2) Check if the job has an unique ID.
-		  3) Fill in missing optional data.
-		  4) Change negative values to zero.
-
-		Raises `InvalidStatsError`.
-		"""
-		non_negative = ['job_id', 'user_id', 'submit']
-		err = None
-
-		for name in self.REQUIRED:
-			if name in stats:
-				if name in non_negative and stats[name] < 0:
-					err = name + 'has negative value'
-			else:
-				err = name + 'value is missing'
-
-		if err is None:
-			if stats['job_id'] in ids:
-				err = 'duplicate ID number'
-			ids.add(stats['job_id'])
-
-		if err is not None:
-			msg = 'job {}: {}'.format(stats.get('job_id'), err)
-			raise InvalidStatsError(msg)
-
-		for name in self.OPTIONAL:
-			stats[name] = stats.get(name, 0)
-			
-		for name in stats:
-			stats[name] = max(0, stats[name])
-
-		return stats
-
 	@abstractmethod
 	def _accept(self, line, num):
 		"""
@@ -220,10 +269,43 @@ class SWFParser(BaseParser):
 			return False  # skip comments
 		return True
 
+	def _parse_lines(self, lines):
+		"""
+		Parse the whole chunk of lines at once.
+
+		All the fields are read as floats (PIK-IPLEX trace uses
+		float in field #6). Fall back to parsing the lines one
+		by one if they have a different number of fields or
+		a used field is not an integer.
+		"""
+		width = len(lines[0].split())
+		# the total count would also match with a shorter
+		# line followed by a longer one
+		if any(len(line.split()) != width for line in lines):
+			return super(SWFParser, self)._parse_lines(lines)
+		values = np.fromstring(' '.join(lines), sep=' ')
+		if values.size != width * len(lines):
+			return super(SWFParser, self)._parse_lines(lines)
+		values = values.reshape(len(lines), width)
+
+		records = {}
+		for name in self.REQUIRED + self.OPTIONAL:
+			field = self.fields[name]
+			if field >= width:
+				return super(SWFParser, self)._parse_lines(lines)
+			column = values[:, field]
+			records[name] = column.astype(np.int64)
+			if not np.array_equal(records[name], column):
+				return super(SWFParser, self)._parse_lines(lines)
+		return records
+
 
 class ICMParser(BaseParser):
 	"""
 	Parser for the ICM workload dump.
+
+	Each line is split only once. The time stamps are converted
+	with a cache of the time stamp prefixes (up to the hour).
 	"""
 
 	fields = {
@@ -235,40 +317,58 @@ class ICMParser(BaseParser):
 		'proc': 11
 	}
 
+	def __init__(self):
+		self._user_ids = {}  # user name -> user ID
+		self._hours = {}  # 'YYYY-MM-DDTHH' -> time stamp
+
 	def _accept(self, line, num):
-		if len(line.split('|')) > 20:
-			return True
-		return False
+		# the same as more than 20 fields, without splitting
+		return line.count('|') >= 20
 
 	def _from_time_str(self, time_str):
-		return time.mktime(time.strptime(time_str, '%Y-%m-%dT%H:%M:%S'))
+		"""
+		Convert 'YYYY-MM-DDTHH:MM:SS' local time to a time stamp.
+		"""
+		hour = time_str[:13]
+		stamp = self._hours.get(hour)
+		if stamp is None:
+			stamp = time.mktime(time.strptime(hour, '%Y-%m-%dT%H'))
+			stamp = self._hours[hour] = int(stamp)
+		return stamp + int(time_str[14:16]) * 60 + int(time_str[17:19])
 
 	def _from_delta_str(self, delta_str):
-		if '-' in delta_str:
-			days, rest = delta_str.split('-')
-			days = int(days)
-		else:
-			rest = delta_str
-			days = 0
-		t = map(int, rest.split(':'))
-		delta = timedelta(days=days, hours=t[0], minutes=t[1], seconds=t[2])
-		return delta.total_seconds()
+		"""
+		Convert '[D-]HH:MM:SS' to seconds.
+		"""
+		days, _, rest = delta_str.rpartition('-')
+		hours, minutes, seconds = rest.split(':')
+		hours = int(hours) + int(days or 0) * 24
+		return (hours * 60 + int(minutes)) * 60 + int(seconds)
 
-	def _parse(self, line, users={}):
+	def _parse_lines(self, lines):
 		"""
 		Custom logic to parse ICM database extract.
 		"""
-		stats = line.split('|')
-		stats = {name: stats[field]
-			for name, field in self.fields.iteritems()}
-
-		if stats['user_id'] not in users:
-			users[stats['user_id']] = len(users) + 1
-		stats['user_id'] = users[stats['user_id']]
-		stats['submit'] = self._from_time_str(stats['submit'])
-		stats['run_time'] = self._from_delta_str(stats['run_time'])
-		stats['time_limit'] = self._from_delta_str(stats['time_limit'])
-
-		for name in stats:
-			stats[name] = int(stats[name])
-		return stats
+		names = ['job_id', 'user_id', 'submit', 'run_time',
+			 'time_limit', 'proc']
+		columns = {name: [] for name in names}
+		id_f, user_f, submit_f, run_f, limit_f, proc_f = [
+			self.fields[name] for name in names]
+		user_ids = self._user_ids
+
+		for line in lines:
+			stats = line.split('|')
+			user = stats[user_f]
+			if user not in user_ids:
+				user_ids[user] = len(user_ids) + 1
+
+			columns['job_id'].append(int(stats[id_f]))
+			columns['user_id'].append(user_ids[user])
+			columns['submit'].append(self._from_time_str(stats[submit_f]))
+			columns['run_time'].append(self._from_delta_str(stats[run_f]))
+			columns['time_limit'].append(
+				self._from_delta_str(stats[limit_f]))
+			columns['proc'].append(int(stats[proc_f]))
+
+		return {name: np.array(values, dtype=np.int64)
+			for name, values in columns.iteritems()}
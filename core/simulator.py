@@ -1,11 +1,10 @@
 # -*- coding: utf-8 -*-
-import heapq
 import itertools
 import logging
 import math
 import time
-import zlib
 import cluster_managers
+import job_queues
 from util import delta
 
 
@@ -19,34 +18,52 @@ class Events(object):
 	estimate_end = 3
 	bf_run = 4
 	campaign_end = 5
-	force_decay = 6
 
 
 class PriorityQueue(object):
 	"""
 	A priority queue of <time, event, entity>, ordered by time.
 	Ties are ordered by the `Events` value.
+
+	The queue is a binary heap with an index of the entry positions,
+	so the time of an already queued event is updated in place.
+
+	Attributes:
+	  max_size: the largest number of queued events.
+	  updates: the number of events updated in place.
 	"""
-	_REMOVED = 'removed-event'
 
 	def __init__(self):
 		self._pq = []
-		self._entries = {}
+		self._entries = {}  # entry key -> position in the heap
 		self._counter = itertools.count()
+		self.max_size = 0
+		self.updates = 0
 
 	def add(self, time, event, entity):
 		"""
 		Add an entity event to the queue.
 		"""
 		key = (event, entity) # must be a unique key
-		if key in self._entries:
-			# mark an existing event as removed
-			self._entries[key][-1] = self._REMOVED
 		# Counter prevents the comparison of entities,
 		# in case the time and the event are the same.
-		entry = [time, event, next(self._counter), entity]
-		self._entries[key] = entry
-		heapq.heappush(self._pq, entry)
+		entry = (time, event, next(self._counter), entity)
+		pos = self._entries.get(key)
+
+		if pos is None:
+			pos = len(self._pq)
+			self._pq.append(entry)
+			self.max_size = max(self.max_size, len(self._pq))
+			self._sift_up(pos)
+		else:
+			# update the existing event
+			prev = self._pq[pos]
+			self._pq[pos] = entry
+			self.updates += 1
+			if entry < prev:
+				self._sift_up(pos)
+			else:
+				self._sift_down(pos)
 
 	def pop(self):
 		"""
@@ -54,12 +71,43 @@ class PriorityQueue(object):
 		Raise KeyError if the queue is empty.
 		"""
 		if not self.empty():
-			time, event, _, entity = heapq.heappop(self._pq)
-			key = (event, entity)
-			del self._entries[key]
+			time, event, _, entity = self._pq[0]
+			del self._entries[(event, entity)]
+			last = self._pq.pop()
+			if self._pq:
+				self._pq[0] = last
+				self._sift_down(0)
 			return time, event, entity
 		raise KeyError('pop from an empty priority queue')
 
+	def remove(self, event, entity):
+		"""
+		Remove the entity event from the queue if present.
+		"""
+		pos = self._entries.pop((event, entity), None)
+		if pos is None:
+			return
+		last = self._pq.pop()
+		if pos < len(self._pq):
+			prev = self._pq[pos]
+			self._pq[pos] = last
+			if last < prev:
+				self._sift_up(pos)
+			else:
+				self._sift_down(pos)
+
+	def shift(self, delta):
+		"""
+		Add `delta` to the time of all the queued events.
+		"""
+		pq = [(entry[0] + delta,) + entry[1:] for entry in self._pq]
+		# the rounding can make some times equal, so the order
+		# is decided by the events and the counters again
+		pq.sort()
+		self._pq = pq
+		self._entries = {(entry[1], entry[3]): pos
+				 for pos, entry in enumerate(pq)}
+
 	def peek(self):
 		"""
 		Peek at the next upcoming event.
@@ -74,15 +122,47 @@ class PriorityQueue(object):
 		"""
 		Check if the queue is empty.
 		"""
-		self._pop_removed()
 		return not self._pq
 
-	def _pop_removed(self):
+	def _sift_up(self, pos):
 		"""
-		Process the queue to the first non-removed event.
+		Move the entry at `pos` towards the root to its place.
 		"""
-		while self._pq and self._pq[0][-1] == self._REMOVED:
-			heapq.heappop(self._pq)
+		pq, entries = self._pq, self._entries
+		entry = pq[pos]
+		while pos > 0:
+			parent_pos = (pos - 1) >> 1
+			parent = pq[parent_pos]
+			if not entry < parent:
+				break
+			pq[pos] = parent
+			entries[(parent[1], parent[3])] = pos
+			pos = parent_pos
+		pq[pos] = entry
+		entries[(entry[1], entry[3])] = pos
+
+	def _sift_down(self, pos):
+		"""
+		Move the entry at `pos` towards the leaves to its place.
+		"""
+		pq, entries = self._pq, self._entries
+		size = len(pq)
+		entry = pq[pos]
+		while True:
+			child_pos = 2 * pos + 1
+			if child_pos >= size:
+				break
+			right_pos = child_pos + 1
+			if right_pos < size and pq[right_pos] < pq[child_pos]:
+				child_pos = right_pos
+			child = pq[child_pos]
+			if not child < entry:
+				break
+			pq[pos] = child
+			entries[(child[1], child[3])] = pos
+			pos = child_pos
+		pq[pos] = entry
+		entries[(entry[1], entry[3])] = pos
 
 
 class Container(object):
@@ -99,6 +179,12 @@ class GeneralSimulator(object):
 	virtual campaigns and effective CPU usage.
 	"""
 
+	# Rebase the decay epoch before the usage values become too large.
+	_MAX_DECAY_GROWTH = 1e100
+	# Rebase the virtual clock before the campaign ends in its
+	# units lose the sub-second precision.
+	_MAX_VIRTUAL_CLOCK = 2.0 ** 30
+
 	def __init__(self, block, users, settings, parts):
 		"""
 		Args:
@@ -115,8 +201,11 @@ class GeneralSimulator(object):
 		self._settings = settings
 		self._parts = parts
 		# create an appropriate cluster manager
-		self._manager = cluster_managers.BaseManager(
-						block.cpus, settings)
+		manager_class = getattr(cluster_managers, settings.manager, None)
+		if manager_class is None:
+			raise Exception('cluster manager not found %s'
+					% settings.manager)
+		self._manager = manager_class(block.cpus, settings)
 
 	def _initialize(self):
 		"""
@@ -126,21 +215,36 @@ class GeneralSimulator(object):
 		self._stats = Container()
 		self._stats.cpu_used = 0
 		self._stats.active_shares = 0
+		self._stats.virtual_clock = 0
 		self._stats.total_usage = 0
+		self._stats.decay_clock = 0
 		# diagnostic statistics
 		self._diag = Container()
 		self._diag.skipped = 0
-		self._diag.forced = 0
+		self._diag.decay_epochs = 0
+		self._diag.virtual_rebases = 0
 		self._diag.sched_pass = self._diag.sched_jobs = 0
 		self._diag.bf_pass = self._diag.bf_jobs = 0
 		self._diag.prev_util = {'time': None, 'value': 0}
 		self._diag.avg_util = {'period': 0, 'sum': 0.0}
 		self._diag.sim_time = time.time()
 
-		self._waiting_jobs = []
-		self._results = []
+		if self._parts.scheduler.grouped_keys:
+			self._waiting_jobs = job_queues.GroupedQueue(
+						self._parts.scheduler)
+		else:
+			self._waiting_jobs = job_queues.WaitingQueue(
+						self._parts.scheduler)
+		# users with active campaigns, keyed by the user ID
+		self._active_users = {}
+		# the estimators can use the run times of the last jobs
+		for u in self._users.itervalues():
+			u.set_run_time_window(self._settings.last_completed)
+		# virtual clock value at the end of the first campaign
+		# of each active user (see `_update_camp_estimates`)
+		self._virtual_ends = PriorityQueue()
+		self._changed_users = {}  # keyed by the user ID
 		self._pq = PriorityQueue()
-		self._compressor = zlib.compressobj()
 		# link the scheduler to the simulation
 		self._parts.scheduler.set_stats(self._stats)
 
@@ -153,31 +257,42 @@ class GeneralSimulator(object):
 		self._diag.avg_util = (self._diag.avg_util['sum'] /
 				       self._diag.avg_util['period'])
 		self._diag.sim_time = time.time() - self._diag.sim_time
+		self._diag.pq_size = self._pq.max_size
+		self._diag.pq_updates = self._pq.updates
+		self._diag.bf_pruned = self._manager.pruned
+		self._diag.bf_tested = self._manager.tested
 		self._diag.sched_jobs /= float(len(self._block))
 		self._diag.bf_jobs /= float(len(self._block))
 		# clear the link to the scheduler
 		self._parts.scheduler.clear_stats()
 
-	def run(self):
+	def run(self, output):
 		"""
 		Proceed with the simulation.
-		Return a list of encountered events.
+		Write the encountered events to the `output` file
+		and return the diagnostic statistics.
 		"""
+		self._output = output
 
 		# Magic value taken from slurm/multifactor plugin.
 		self._decay_factor = 1 - (0.693 / self._settings.decay)
 		# Note:
-		#   The CPU usage decay is always applied after each event.
-		#   There is also a dummy `force_decay` event inserted into
-		#   the queue to force the calculations in case the gap
-		#   between consecutive events would be too long.
-		#TODO ZAMIENIC APPLY DECAY NA BACKGROUND THREAD TAK SAMO JAK BACKFILLING?!?!?!
-		#TODO WTEDY BEDZIE TRZEBA TRZYMAC "TEMPORARY" USAGE GDZIES ODDZIELNIE I GO DODAWAC
-		#TODO DO GLOWNEGO DOPIERO PRZY URUCHOMIENIU TEGO "THREADA"
+		#   The CPU usage decay is applied as if it was calculated
+		#   after each event and at least every `_force_period`
+		#   while there are jobs in the simulation, but lazily
+		#   (see `_decay_work`).
 		self._force_period = 60 * 5
+		self._decay_rate = -math.log(self._decay_factor)
+		self._decay_epoch = self._block.start
+		# the longest period with the growth below the limit
+		steps = math.log(self._MAX_DECAY_GROWTH) / self._decay_rate
+		steps = max(int(steps / self._force_period), 1)
+		self._max_decay_period = steps * self._force_period
 
 		self._initialize()
 
+		# the jobs are created as they are submitted
+		jobs = iter(self._block)
 		sub_iter = sub_count = 0
 		sub_total = len(self._block)
 		end_iter = 0
@@ -187,7 +302,7 @@ class GeneralSimulator(object):
 			      not self._settings.bf_interval)
 
 		# the first job submission is the simulation 'time zero'
-		prev_event = self._block[0].submit
+		prev_event = self._block.start
 		self._diag.prev_util['time'] = prev_event
 
 		visual_update = 60  # notify the user about the progress
@@ -198,30 +313,30 @@ class GeneralSimulator(object):
 			# We only need to keep two `new_job` events in the
 			# queue at the same time (one to process, one to peek).
 			while sub_iter < sub_total and sub_count < 2:
+				job = next(jobs)
 				self._pq.add(
-					self._block[sub_iter].submit,
+					job.submit,
 					Events.new_job,
-					self._block[sub_iter]
+					job
 				)
 				sub_iter += 1
 				sub_count += 1
 			# the queue cannot be empty here
 			self._now, event, entity = self._pq.pop()
 
-			if event != Events.force_decay:
-				logging.debug('Time %s, event %s', delta(self._now), event)
+			logging.debug('Time %s, event %s', delta(self._now), event)
 
 			# Process the time skipped between events
 			# before changing the state of the system.
 			diff = self._now - prev_event
 			if diff:
 				self._virt_first_stage(diff)
-				self._real_first_stage(diff)
+				# the decay is forced while there are jobs left
+				self._real_first_stage(diff, end_iter < sub_total)
 			# The default flow is to redistribute the virtual
 			# time and compute new campaign ends (and maybe do
 			# a scheduling / backfilling pass in the between).
 			virt_second = True
-			campaigns = True
 
 			if event == Events.new_job:
 				# check if the job is runnable
@@ -245,11 +360,7 @@ class GeneralSimulator(object):
 				# so the campaign can actually end.
 				self._virt_second_stage()
 				virt_second = False  # already done
-				campaigns = self._camp_end_event(entity)
-			elif event == Events.force_decay:
-				self._diag.forced += 1
-				virt_second = False  # no need to do it now
-				campaigns = False  # no change to campaign ends
+				self._camp_end_event()
 			else:
 				raise Exception('unknown event')
 
@@ -283,8 +394,7 @@ class GeneralSimulator(object):
 				self._update_util()  # must be after schedule
 				backfill = False
 
-			if campaigns:
-				self._update_camp_estimates()
+			self._update_camp_estimates()
 
 			# add periodically occurring events
 			if event < Events.bf_run:
@@ -292,12 +402,6 @@ class GeneralSimulator(object):
 			elif event == Events.bf_run and backfilled_jobs:
 				self._next_backfill(self._now + 1)
 
-			if end_iter < sub_total:
-				# There are still jobs in the simulation
-				# so we need an accurate usage.
-				assert not self._pq.empty(), 'infinite loop'
-				self._next_force_decay()
-
 			# progress report
 			if time.time() > next_visual:
 				next_visual += visual_update
@@ -305,8 +409,9 @@ class GeneralSimulator(object):
 				msg = 'Block {:2} scheduler {}: {} completed {:.2f}%'
 				logging.info(msg.format(self._block.number, self._parts.scheduler,
 						 time.strftime('%H:%M:%S'), comp * 100))
-				if self._waiting_jobs:
-					top_prio = self._waiting_jobs[-1].proc
+				top_job = self._waiting_jobs.peek()
+				if top_job is not None:
+					top_prio = top_job.proc
 				else:
 					top_prio = -1
 				logging.info('events {} {}  |  cpus {} {}  |  waiting jobs {} {}'
@@ -322,51 +427,96 @@ class GeneralSimulator(object):
 		self._finalize()
 		# Results for each user should be in this order:
 		#  1) job ends (this is done during simulation)
-		#  2) camp ends
+		#  2) camp ends (the released ones are already stored)
 		#  3) user stats
 		for u in self._users.itervalues():
 			for i, c in enumerate(u.completed_camps):
 				self._store_camp_ended(c)
 			self._store_user_stats(u)
 
-		# merge the results
-		self._results.append(self._compressor.flush())
-		self._results = ''.join(self._results)
-		return self._results, self._diag
+		self._output = None
+		return self._diag
 
 	def _virt_first_stage(self, period):
 		"""
 		In the first virtual stage we just distribute
 		the virtual time for the period to active users.
 		"""
-		for u in self._users.itervalues():
-			if u.active_camps:
-				u.add_virtual(period * self._share_cpu_value(u))
+		if self._active_users:
+			# the virtual time received by a single share
+			cpus = max(self._stats.cpu_used, 1)
+			self._stats.virtual_clock += (period * cpus /
+						      self._stats.active_shares)
+		for u in self._active_users.itervalues():
+			u.add_virtual(period * self._share_cpu_value(u))
 
 	def _virt_second_stage(self):
 		"""
 		In the second virtual stage active users redistribute
 		the accumulated virtual time.
 		"""
-		for u in self._users.itervalues():
-			if u.active_camps:
-				u.virtual_work()
+		for u in self._active_users.itervalues():
+			u.virtual_work()
 
-	def _real_first_stage(self, period):
+	def _real_first_stage(self, period, forced):
 		"""
 		Update the real work done by the jobs in the period
-		and apply the rolling decay.
+		and advance the decay clock.
+		The decay is forced every `_force_period` if `forced`.
 
 		This is currently the only real stage.
 		"""
-		# calculate the decay factor for the period
-		real_decay = self._decay_factor ** period
-		# update global statistics
-		self._stats.total_usage += self._stats.cpu_used * period
-		self._stats.total_usage *= real_decay
-		# and update users usage
+		start = self._now - period
+		while period:
+			if forced:
+				step = min(period, self._max_decay_period)
+			else:
+				step = period
+			if start - self._decay_epoch > self._max_decay_period:
+				self._next_decay_epoch(start)
+			work = self._decay_work(start, step, forced)
+			# only the global statistics are updated here,
+			# users catch up when their CPU count changes
+			self._stats.total_usage += self._stats.cpu_used * work
+			self._stats.decay_clock += work
+			start += step
+			period -= step
+
+	def _decay_work(self, start, period, forced):
+		"""
+		The work done by a single CPU in the period since `start`,
+		in the decay clock units.
+
+		Instead of decaying the usage of every user after each event,
+		the CPU usage is measured in the units that grow exponentially
+		since the decay epoch. The work done in a period is weighted
+		by the value at the start of the period, which is the same as
+		decaying it with all the later periods. The usage values in
+		these units are proportional to the decayed values, so the
+		ratio between any two of them is the same.
+
+		The forced periods are summed as a geometric series.
+		"""
+		weight = math.exp(self._decay_rate * (start - self._decay_epoch))
+		if not forced or period <= self._force_period:
+			return period * weight
+		full, rest = divmod(period, self._force_period)
+		growth = self._decay_rate * self._force_period
+		series = math.expm1(growth * full) / math.expm1(growth)
+		return weight * (self._force_period * series +
+				 rest * math.exp(growth * full))
+
+	def _next_decay_epoch(self, t):
+		"""
+		Move the decay epoch to time `t` and rescale all usage values.
+		"""
+		scale = math.exp(self._decay_rate * (self._decay_epoch - t))
+		self._stats.total_usage *= scale
+		self._stats.decay_clock *= scale
 		for u in self._users.itervalues():
-			u.real_work(period, real_decay)
+			u.rescale_usage(scale)
+		self._decay_epoch = t
+		self._diag.decay_epochs += 1
 
 	def _share_cpu_value(self, user):
 		"""
@@ -379,27 +529,67 @@ class GeneralSimulator(object):
 		cpus = max(self._stats.cpu_used, 1)
 		return share * cpus
 
-	def _queue_camp_end(self, camp):
+	def _virtual_rate(self):
 		"""
-		Create the `campaign_end` event and insert it to the queue.
+		The virtual time received by a single share per second.
 		"""
-		est = camp.time_left / self._share_cpu_value(camp.user)
-		est = self._now + math.ceil(est)
-		self._pq.add(
-			int(est),  # must be int
-			Events.campaign_end,
-			camp
-		)
+		cpus = max(self._stats.cpu_used, 1)
+		return float(cpus) / self._stats.active_shares
+
+	def _invalidate(self, user):
+		"""
+		Mark the values depending on the user campaigns
+		and the CPU usage as outdated.
+		"""
+		self._waiting_jobs.invalidate(user)
+		self._changed_users[user.ID] = user
 
 	def _update_camp_estimates(self):
 		"""
 		Update estimated campaign end times in the virtual schedule.
 		Only the first campaign is considered from each user,
 		since the subsequent campaigns are guaranteed to end later.
+
+		The ends are kept in the virtual clock units, which don't
+		depend on the CPU usage and the active shares, so only the
+		ends of the changed users are recomputed. The earliest end
+		is then converted to the real time of the `campaign_end` event.
 		"""
-		for u in self._users.itervalues():
+		if self._stats.virtual_clock > self._MAX_VIRTUAL_CLOCK:
+			self._rebase_virtual_clock()
+
+		for u in self._changed_users.itervalues():
 			if u.active_camps:
-				self._queue_camp_end(u.active_camps[0])
+				left = float(u.active_camps[0].time_left) / u.shares
+				self._virtual_ends.add(
+					self._stats.virtual_clock + left,
+					Events.campaign_end,
+					u
+				)
+		self._changed_users.clear()
+
+		if self._virtual_ends.empty():
+			self._pq.remove(Events.campaign_end, 'Campaign end event')
+			return
+
+		end, _, _ = self._virtual_ends.peek()
+		est = (end - self._stats.virtual_clock) / self._virtual_rate()
+		est = self._now + max(math.ceil(est), 0)
+		self._pq.add(
+			int(est),  # must be int
+			Events.campaign_end,
+			'Campaign end event'
+		)
+
+	def _rebase_virtual_clock(self):
+		"""
+		Move the virtual clock back to zero, together with
+		the campaign ends. Only the differences between
+		these values are used, so the order doesn't change.
+		"""
+		self._virtual_ends.shift(-self._stats.virtual_clock)
+		self._stats.virtual_clock = 0
+		self._diag.virtual_rebases += 1
 
 	def _next_backfill(self, start):
 		"""
@@ -416,16 +606,6 @@ class GeneralSimulator(object):
 			'Backfill event'
 		)
 
-	def _next_force_decay(self):
-		"""
-		Add/update the next decay event.
-		"""
-		self._pq.add(
-			self._now + self._force_period,
-			Events.force_decay,
-			'Decay event'
-		)
-
 	@property
 	def _utility(self):
 		"""
@@ -444,6 +624,7 @@ class GeneralSimulator(object):
 		"""
 		Start the job execution.
 		"""
+		job.user.real_work(self._stats.decay_clock)
 		job.start_execution(self._now)
 		# update stats
 		self._stats.cpu_used += job.proc
@@ -473,44 +654,41 @@ class GeneralSimulator(object):
 		if not self._cpu_free or not self._waiting_jobs:
 			return 0  # nothing to do
 
-		#sort the jobs using the ordering defined by the scheduler
-		self._waiting_jobs.sort(
-			key=self._parts.scheduler.job_priority_key,
-			reverse=True
-		)
-
 		if bf_mode:
 			try_func = self._manager.try_backfill
 			assert self._settings.bf_depth, 'invalid bf_depth'
 			work = min(len(self._waiting_jobs), self._settings.bf_depth)
+			# order the jobs using the keys defined by the scheduler,
+			# only the first `work` jobs can be considered
+			self._waiting_jobs.refresh(work)
 		else:
 			try_func = self._manager.try_schedule
 			work = len(self._waiting_jobs)
+			self._waiting_jobs.refresh()
 
 		self._manager.start_session(self._now)
+		started = []
 
-		# last job has the highest priority
-		prio_iter = len(self._waiting_jobs) - 1
-		started = 0
-
-		while self._cpu_free and work:
-			job = self._waiting_jobs[prio_iter]
+		# first job has the highest priority
+		for job in self._waiting_jobs:
+			if not self._cpu_free or not work:
+				break
 
 			if try_func(job):
-				j2 = self._waiting_jobs.pop(prio_iter)
-				assert job == j2, 'scheduled wrong job'
-
 				self._execute(job)
-				started += 1
+				started.append(job)
 				logging.debug('bf %s started %s', bf_mode, job)
 			elif not bf_mode:
 				break
 
-			prio_iter -= 1
 			work -= 1
 
+		# the queue can't be changed during the iteration
+		for job in started:
+			self._waiting_jobs.remove(job)
+
 		self._manager.end_session()
-		return started
+		return len(started)
 
 	def _new_job_event(self, job):
 		"""
@@ -521,6 +699,7 @@ class GeneralSimulator(object):
 		if not user.active_camps:
 			# user is now active after this job submission
 			self._stats.active_shares += user.shares
+			self._active_users[user.ID] = user
 
 		job.estimate = self._parts.estimator.initial_estimate(job)
 		camp = self._parts.selector.find_campaign(job)
@@ -532,18 +711,22 @@ class GeneralSimulator(object):
 		camp.add_job(job)
 		user.add_job(job)
 		# enqueue the job
-		self._waiting_jobs.append(job)
+		self._waiting_jobs.add(job)
+		self._invalidate(user)
 
 	def _job_end_event(self, job):
 		"""
 		Free the resources.
 		"""
 		assert job.estimate >= job.run_time, 'invalid estimate'
+		job.user.real_work(self._stats.decay_clock)
 		job.execution_ended(self._now)
+		self._invalidate(job.user)
 		self._manager.job_ended(job)
 		self._stats.cpu_used -= job.proc
 		assert self._stats.cpu_used >= 0, 'invalid cpu count'
 		self._store_job_ended(job)  # add results
+		self._release_completed(job.user)
 
 	def _estimate_end_event(self, job):
 		"""
@@ -556,9 +739,11 @@ class GeneralSimulator(object):
 			# user became inactive due to inaccurate estimates
 			user.false_inactivity += (self._now - user.last_active)
 			self._stats.active_shares += user.shares
+			self._active_users[user.ID] = user
 
 		new_est = self._parts.estimator.next_estimate(job)
 		job.next_estimate(new_est)
+		self._invalidate(user)
 
 		# add the next event if we will need it
 		if job.estimate < job.run_time:
@@ -568,40 +753,61 @@ class GeneralSimulator(object):
 				job
 			)
 
-	def _camp_end_event(self, camp):
+	def _camp_end_event(self):
 		"""
 		Remove the campaigns that ended in the virtual schedule.
-		Update the owner activity status.
-
-		Return if the `_update_camp_estimates` call is needed.
 		"""
-		user = camp.user
+		# The event time is rounded up, so all the users with the
+		# end before the next second are checked. The campaigns
+		# that haven't ended yet are simply estimated again.
+		limit = self._stats.virtual_clock + self._virtual_rate()
 
-		if not user.active_camps or camp != user.active_camps[0]:
-			# In the `_update_camp_estimates` we aren't removing
-			# the old `campaign_end` events from the queue,
-			# so it is possible that this event is out of order.
-			logging.debug('Skipping campaign_end event %s', camp)
-			return
+		while not self._virtual_ends.empty():
+			end, _, user = self._virtual_ends.peek()
+			if end >= limit:
+				break
+			self._virtual_ends.pop()
+			self._end_campaigns(user)
 
+	def _end_campaigns(self, user):
+		"""
+		Remove the user campaigns that ended in the virtual schedule.
+		Update the owner activity status.
+
+		Return if the user became inactive.
+		"""
 		while user.active_camps and not user.active_camps[0].time_left:
 			# remove in one go all of the campaigns that end now
-			ended = user.active_camps.pop(0)
+			ended = user.active_camps.popleft()
 			user.completed_camps.append(ended)
+		self._invalidate(user)
+		self._release_completed(user)
 
 		if not user.active_camps:
 			# user became inactive
 			user.last_active = self._now
 			self._stats.active_shares -= user.shares
+			del self._active_users[user.ID]
 			# fix possible rounding errors
 			self._stats.active_shares = max(self._stats.active_shares, 0)
-			# we need new estimates, because the shares changed
 			return True
 		else:
-			self._queue_camp_end(user.active_camps[0])
-			# shares are still the same
+			# the end of the next campaign is estimated later
 			return False
 
+	def _release_completed(self, user):
+		"""
+		Store the user campaigns that can't change anymore and stop
+		keeping them, along with the completed jobs.
+		Only if the `keep_completed` setting is off.
+		"""
+		if self._settings.keep_completed:
+			return
+		for camp in user.release_completed():
+			self._store_camp_ended(camp)
+			for job in camp.completed_jobs:
+				job.camp = None
+
 	def _update_util(self):
 		"""
 		Keep track of the system average utility.
@@ -682,8 +888,8 @@ class GeneralSimulator(object):
 		       false_inactivity_period
 		"""
 		msg = 'USER {} {} {} {} {}\n'.format(
-			user.ID, len(user.completed_jobs),
-			len(user.completed_camps),
+			user.ID, user.completed_job_count,
+			user.completed_camp_count,
 			user.lost_virtual, user.false_inactivity)
 		self._save(msg)
 
@@ -697,9 +903,9 @@ class GeneralSimulator(object):
 
 	def _save(self, msg):
 		"""
-		Compress the message before adding it to the results.
+		Write the message to the results.
 		"""
-		self._results.append(self._compressor.compress(msg))
+		self._output.write(msg)
 
 	def __str__(self):
 		return self.__class__.__name__
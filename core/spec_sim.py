@@ -8,15 +8,12 @@ class VirtualSimulator(GeneralSimulator):
 	Only keeps track of the virtual campaigns.
 	"""
 
-	def _real_first_stage(self, period):
-		pass
-
-	def _next_force_decay(self):
+	def _real_first_stage(self, period, forced):
 		pass
 
 	def _finalize(self):
 		GeneralSimulator._finalize(self)
-		assert not self._diag.forced, 'decay calculated'
+		assert not self._diag.decay_epochs, 'decay calculated'
 
 
 class RealSimulator(GeneralSimulator):
@@ -44,9 +41,9 @@ class RealSimulator(GeneralSimulator):
 		GeneralSimulator._virt_second_stage(self)
 
 		for u in self._users.itervalues():
-			assert u.active_camps or not u.completed_jobs, \
+			assert u.active_camps or not u.completed_job_count, \
 			    'user with jobs is inactive'
-			if u.completed_jobs:
-				inactive = self._camp_end_event(u.active_camps[0])
+			if u.completed_job_count:
+				inactive = self._end_campaigns(u)
 				assert inactive, 'still active user'
 				assert not u.active_camps, 'still active user'
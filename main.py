@@ -1,21 +1,45 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8 -*-
 import argparse
+import cPickle
 import functools
 import glob
+import hashlib
 import importlib
+import inspect
+import itertools
 import logging
 import multiprocessing
 import os
+import shutil
 import sys
 import time
-import zlib
+import numpy as np
 from core import parsers, simulator, spec_sim
+from core.job_table import JobTable
 from parts import settings
 
 
 PROFILE_FLAG = False
 
+# The simulation state shared with the worker processes.
+# It is set before the workers are forked, so the tasks only
+# carry the block and scheduler indexes (see `simulate_shared`).
+SHARED = {}
+
+# Settings used to prepare the workload and divide it into blocks.
+# They are the same for all the simulations sharing the workload.
+WORKLOAD_SETTINGS = ['job_id', 'block_time', 'block_margin', 'one_block',
+		     'block_number', 'serial', 'output', 'cache',
+		     'cache_results', 'submitter', 'default_limit',
+		     'share', 'share_file']
+
+# The directory of the simulator code, `__file__` can be relative.
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Hash of the simulator code, see `code_key`.
+CODE_KEY = None
+
 
 ##
 ## Action ``run``.
@@ -25,7 +49,12 @@ PROFILE_FLAG = False
 class Block(object):
 	"""
 	A block uses a set of indexes to extract the appropriate
-	job slice from the full list of jobs.
+	job slice from the full table of jobs.
+
+	Iterating over a block creates new `Job` instances,
+	one at a time (see `JobTable.iter_jobs`).
+
+	The `indexes` attribute keeps the indexes in this order.
 
 	Note: all indexes are inclusive:
 	  left - (index of) the first job of the left margin
@@ -37,39 +66,77 @@ class Block(object):
 	def __init__(self, jobs, inx, block_time, num):
 		"""
 		Args:
-		  jobs: full list of jobs.
+		  jobs: full `JobTable` of jobs.
 		  inx: dictionary with indexes.
 		  block_time: core length.
 		  num: block number
 
 		"""
-		self._jobs = jobs[inx['left']:inx['right']+1]
-		self._first_core = jobs[inx['first']]
+		self.table = jobs.take(slice(inx['left'], inx['right']+1))
+		self.indexes = tuple(inx[name] for name in
+				     ['left', 'first', 'last', 'right'])
+		self._first_core_id = int(jobs.ID[inx['first']])
+		self._first_core_submit = int(jobs.submit[inx['first']])
 		self._block_time = block_time
 
 		self.core_count = inx['last'] - inx['first'] + 1
-		self.margin_count = len(self._jobs) - self.core_count
+		self.margin_count = len(self.table) - self.core_count
 
 		self.number = num
 
+	@property
+	def start(self):
+		"""
+		The submit time of the first job.
+		"""
+		return int(self.table.submit[0])
+
 	@property
 	def core_period(self):
-		return (self._first_core.submit,
-			self._first_core.submit + self._block_time)
+		return (self._first_core_submit,
+			self._first_core_submit + self._block_time)
 
-	def __len__(self):
-		return len(self._jobs)
+	def cost(self, cpus):
+		"""
+		The predicted relative cost of simulating the block
+		with `cpus` CPUs.
+
+		The number of jobs (including the margins) weighted by the
+		CPU load, because on an overloaded cluster more jobs wait
+		in the queue during each scheduling pass.
+		"""
+		jobs = self.table
+		period = max(jobs.submit[-1] - jobs.submit[0], 1)
+		work = np.dot(jobs.run_time, jobs.proc)
+		load = work / float(period * cpus)
+		return len(jobs) * max(load, 1.0)
+
+	@property
+	def users(self):
+		"""
+		A dictionary of the job owners, keyed by the user ID.
+
+		The users are added in the order of their first jobs, like
+		in the original simulator. Iterating over a dictionary
+		depends on this order, and so does the order of the
+		records stored for each user.
+		"""
+		users = self.table.users
+		user_ids = self.table.user_id
+		_, first = np.unique(user_ids, return_index=True)
+		return {uid: users[uid] for uid in
+			user_ids[np.sort(first)].tolist()}
 
-	def __getitem__(self, key):
-		return self._jobs[key]
+	def __len__(self):
+		return len(self.table)
 
 	def __iter__(self):
-		return iter(self._jobs)
+		return self.table.iter_jobs()
 
 	def __repr__(self):
 		s = 'Block {:2} (core id {}): {} jobs' \
 		    ' (inc. {} margin jobs), {} CPUs'
-		return s.format(self.number, self._first_core.ID,
+		return s.format(self.number, self._first_core_id,
 			len(self), self.margin_count, self.cpus)
 
 
@@ -79,7 +146,7 @@ def divide_jobs(jobs, first_job, block_time, block_margin):
 	Each block can have extra jobs to fill up and empty the cluster.
 
 	Args:
-	  jobs: list of all the jobs.
+	  jobs: `JobTable` of all the jobs, ordered by the submit time.
 	  first_job: ID of the first job to start with or ``zero``.
 	  block_time: length of each block in seconds or ``zero``.
 	  block_margin: extra length added to the blocks on both sides.
@@ -88,38 +155,33 @@ def divide_jobs(jobs, first_job, block_time, block_margin):
 	  a list of consecutive blocks as `Block` instances.
 	"""
 	if first_job:
-		for i, j in enumerate(jobs):
-			if j.ID == first_job:
-				break
-		else:
+		found = np.flatnonzero(jobs.ID == first_job)
+		if not len(found):
 			raise Exception('job ID %s not found' % first_job)
+		i = int(found[0])
 	else:
 		i = 0
 
 	# 'i' now points to first job of the first block
 	blocks = []
+	submit = jobs.submit
 
 	while i < len(jobs):
 		inx = {'first': i}
-		st = jobs[i].submit
+		st = submit[i]
 		end = st + block_time
 
-		while i >= 0 and st - jobs[i].submit <= block_margin:
-			i -= 1
-
-		inx['left'] = i + 1
+		# the first job submitted within the margin
+		inx['left'] = int(np.searchsorted(submit, st - block_margin))
 
 		if not block_time:
 			inx['last'] = inx['right'] = len(jobs) - 1
 			block_time = float('inf')
 		else:
-			i = inx['first']
-			while i < len(jobs) and jobs[i].submit < end:
-				i += 1
-			inx['last'] = i - 1
-			while i < len(jobs) and jobs[i].submit < end + block_margin:
-				i += 1
-			inx['right'] = i - 1
+			# the first jobs submitted after the core and the margin
+			inx['last'] = int(np.searchsorted(submit, end)) - 1
+			inx['right'] = int(np.searchsorted(submit,
+							   end + block_margin)) - 1
 
 		blocks.append(
 			Block(jobs, inx, block_time, len(blocks))
@@ -137,36 +199,35 @@ def cpu_percentile(block, percentile):
 	Note:
 	  We are assuming that the system has no CPU limit.
 	"""
-	events = {}  # pairs <time-stamp, change in the number of CPUs>
-	last_event = block[-1].submit
-
-	for j in block:
-		events[j.submit] = events.get(j.submit, 0) + j.proc
-		end = min(j.submit + j.run_time, last_event)
-		events[end] = events.get(end, 0) - j.proc
-
-	events = sorted(events.iteritems())  # sort by time-stamp
-	prev_event, cpus = events[0][0], 0
-	util = {}  # pairs <number of CPUs, total period with that CPU count>
-
-	for time_stamp, diff in events:
-		period = time_stamp - prev_event
-		prev_event = time_stamp
-		util[cpus] = util.get(cpus, 0) + period
-		cpus += diff
-
-	total = sum(util.itervalues())  # total simulation period
+	jobs = block.table
+	last_event = jobs.submit[-1]
+
+	# pairs <time-stamp, change in the number of CPUs>
+	times = np.concatenate((jobs.submit,
+				np.minimum(jobs.submit + jobs.run_time, last_event)))
+	diffs = np.concatenate((jobs.proc, -jobs.proc))
+	# merge the changes at the same time-stamp
+	times, inverse = np.unique(times, return_inverse=True)
+	changes = np.zeros(len(times), dtype=np.int64)
+	np.add.at(changes, inverse, diffs)
+
+	# the number of CPUs used between the consecutive time-stamps
+	used = np.concatenate(([0], np.cumsum(changes)[:-1]))
+	periods = np.concatenate(([0], np.diff(times)))
+
+	# total periods with each CPU count, ordered by the CPU count
+	used, inverse = np.unique(used, return_inverse=True)
+	util = np.zeros(len(used), dtype=np.int64)
+	np.add.at(util, inverse, periods)
+
+	total = util.sum()  # total simulation period
 	find = int(percentile / 100.0 * total)
 
-	# sort by CPU usage and find the percentile
-	util = sorted(util.iteritems())
-	elements = 0
-	for cpus, period in util:
-		elements += period
-		if elements >= find:
-			return cpus
-	else:
+	# find the percentile
+	i = np.searchsorted(np.cumsum(util), find)
+	if i == len(used):
 		raise Exception('invalid percentile %s' % percentile)
+	return int(used[i])
 
 
 def threshold_percentile(jobs):
@@ -176,11 +237,10 @@ def threshold_percentile(jobs):
 	last_sub = {}
 	values = []
 
-	for j in jobs:
-		jid = j.user.ID
+	for jid, submit in zip(jobs.user_id.tolist(), jobs.submit.tolist()):
 		if jid in last_sub:
-			values.append(j.submit - last_sub[jid])
-		last_sub[jid] = j.submit
+			values.append(submit - last_sub[jid])
+		last_sub[jid] = submit
 
 	values.sort()
 	for i in xrange(50, 100):
@@ -231,14 +291,19 @@ def print_stats(diag):
 
 	line0 = '    Backfilled jobs {bf_jobs:.2f}%, average utilization {avg_util:.2f}%'
 	line1 = '    Backfill loops {bf_pass}, sched loops {sched_pass}'
-	line2 = '    Simulation time {sim_time:.2f}s, decay events {forced}'
+	line2 = ('    Simulation time {sim_time:.2f}s, decay epochs {decay_epochs},'
+		 ' virtual clock rebases {virtual_rebases}')
+	line3 = '    Event queue peak size {pq_size}, updated events {pq_updates}'
+	line4 = '    Backfill attempts pruned {bf_pruned}, tested {bf_tested}'
 
 	logging.info(line0.format(**vars(diag)))
 	logging.info(line1.format(**vars(diag)))
 	logging.info(line2.format(**vars(diag)))
+	logging.info(line3.format(**vars(diag)))
+	logging.info(line4.format(**vars(diag)))
 
 
-def simulate_block(block, sched, alg_conf, part_conf):
+def simulate_block(block, sched, alg_conf, part_conf, filename):
 	"""
 	Do a simulation on the specified block.
 
@@ -247,20 +312,17 @@ def simulate_block(block, sched, alg_conf, part_conf):
 	  sched: selected scheduler from part_conf.schedulers.
 	  alg_conf: algorithmic settings.
 	  part_conf: parts instances.
+	  filename: file to write all the events to.
 
 	Return:
-	  a string with all the events.
 	  diagnostic statistics from the run.
 
 	"""
 	assert block.cpus, 'invalid block cpu count'
 
-	# extract the users and reset all instances
-	users = {}
-
-	for j in block:
-		j.reset()
-		users[j.user.ID] = j.user
+	# extract the users and reset them,
+	# the jobs are created during the simulation
+	users = block.users
 	for u in users.itervalues():
 		u.reset()
 
@@ -277,21 +339,193 @@ def simulate_block(block, sched, alg_conf, part_conf):
 
 	logging.log(15, '{} using {}'.format(sched, my_sim))
 
-	if not PROFILE_FLAG:
-		r = my_sim.run()
-		# restore original values
-		#TODO TO POWINNO BYC JEDNAK USELESS SKORO JEST WSZYSTKO KOPIOWANE!!
-		for j in block:
-			j.reset()
-		for u in users.itervalues():
-			u.reset()
-		return r
-	else:
-		import cProfile
-		cProfile.runctx('print my_sim.run()[1].__dict__',
-				globals(), locals(),
-				sort='cumulative')
-		sys.exit(0)
+	with open(filename, 'w') as output:
+		if not PROFILE_FLAG:
+			r = my_sim.run(output)
+			# restore original values
+			for u in users.itervalues():
+				u.reset()
+			return r
+		else:
+			import cProfile
+			cProfile.runctx('print my_sim.run(output).__dict__',
+					globals(), locals(),
+					sort='cumulative')
+			sys.exit(0)
+
+
+def simulate_shared(point, block_num, sched_num, filename, keep):
+	"""
+	Do a simulation on the block from `SHARED`, see `simulate_block`.
+
+	Args:
+	  point: index of the simulation settings in `SHARED['confs']`.
+	  block_num: index of the block in `SHARED['blocks']`.
+	  sched_num: index of the scheduler in the `part_conf.schedulers`.
+	  filename: file to write all the events to.
+	  keep: also store the diagnostic statistics (see `load_result`).
+	"""
+	block = SHARED['blocks'][block_num]
+	block.cpus = SHARED['cpus'][point][block_num]
+	sim_conf, alg_conf, part_conf = SHARED['confs'][point]
+	if not keep:
+		return simulate_block(block, part_conf.schedulers[sched_num],
+				      alg_conf, part_conf, filename)
+
+	# write to temporary files so a partial result is never loaded
+	temp = '{}.{}.tmp'.format(filename, os.getpid())
+	diag = simulate_block(block, part_conf.schedulers[sched_num],
+			      alg_conf, part_conf, temp)
+	os.rename(temp, filename)
+	with open(temp, 'wb') as f:
+		cPickle.dump(diag, f, cPickle.HIGHEST_PROTOCOL)
+	os.rename(temp, filename + '.diag')
+	return diag
+
+
+def load_result(filename):
+	"""
+	Return the diagnostic statistics of a result stored by
+	`simulate_shared` or `None` if there is no such result.
+	"""
+	try:
+		with open(filename + '.diag', 'rb') as f:
+			return cPickle.load(f)
+	except IOError:
+		return None
+
+
+def result_key(workload_key, block, cpus, sched, args):
+	"""
+	Return a hash identifying the result of a block simulation.
+
+	Args:
+	  workload_key: hash of the prepared workload (see `workload_key`).
+	  block: the simulated `Block`.
+	  cpus: the number of CPUs.
+	  sched: the scheduler instance.
+	  args: the simulation arguments, only the algorithm
+	    and part settings are used.
+
+	Note:
+	  The hash also covers the simulator code (see `code_key`)
+	  and the content of the ``share_file``.
+	"""
+	names = [temp.name for temp in settings.alg_templates +
+		 settings.part_templates if temp.name != 'schedulers']
+	values = sorted((name, args[name]) for name in names)
+	h = hashlib.sha1(workload_key)
+	h.update(code_key())
+	if os.path.isfile(args['share_file']):
+		hash_file(h, args['share_file'])
+	h.update(repr((block.indexes, block.core_period, cpus,
+		       sched.__class__.__name__, values)))
+	return h.hexdigest()
+
+
+def code_key():
+	"""
+	Return a hash of the simulator code: this file and the
+	modules from the ``core`` and ``parts`` packages.
+
+	The hash is computed once (see `CODE_KEY`).
+	"""
+	global CODE_KEY
+	if CODE_KEY is None:
+		files = ([os.path.join(ROOT_DIR, 'main.py')] +
+			 sorted(glob.glob(os.path.join(ROOT_DIR, 'core', '*.py'))) +
+			 sorted(glob.glob(os.path.join(ROOT_DIR, 'parts', '*.py'))))
+		CODE_KEY = source_key(files)
+	return CODE_KEY
+
+
+def source_key(files):
+	"""
+	Return a hash of the names and the content of the files.
+	"""
+	h = hashlib.sha1()
+	for f in files:
+		h.update(os.path.basename(f))
+		hash_file(h, f)
+	return h.hexdigest()
+
+
+def hash_file(h, filename):
+	"""
+	Update the hash `h` with the content of the file.
+	"""
+	with open(filename, 'rb') as f:
+		for chunk in iter(lambda: f.read(1 << 20), ''):
+			h.update(chunk)
+
+
+def prepare_jobs(workload, sim_conf, part_conf):
+	"""
+	Parse the workload, order the jobs by the submit time
+	and set the time limits.
+
+	The prepared `JobTable` is cached in the `sim_conf.cache`
+	directory, in a file named after the workload content,
+	the settings and the code used to prepare it.
+
+	Return:
+	  the `JobTable`.
+	  the hash used as the name of the cached file, `None` if
+	  the cache is turned off (see `workload_key`).
+	"""
+	parser = parsers.get_parser(workload)
+	key = None
+
+	if sim_conf.cache:
+		if not os.path.isdir(sim_conf.cache):
+			os.makedirs(sim_conf.cache)
+		key = workload_key(workload, parser, sim_conf.serial,
+				   part_conf.submitter)
+		filename = os.path.join(sim_conf.cache, key + '.npy')
+		if os.path.isfile(filename):
+			jobs = JobTable.load(filename)
+			logging.info('Loaded {} job records from the cache file {}'
+				     .format(len(jobs), filename))
+			return jobs, key
+
+	jobs, users = parser.parse_workload(workload, sim_conf.serial)
+	jobs = jobs.sort_by_submit()
+
+	# set job time limit and validate run time
+	jobs.time_limit = part_conf.submitter.time_limits(jobs)
+	over = jobs.run_time > jobs.time_limit
+	jobs.run_time[over] = jobs.time_limit[over]
+	killed = np.count_nonzero(over)
+
+	if killed:
+		logging.warn('%s jobs will end prematurely due to insufficient'
+		             ' time limit' % killed)
+
+	if sim_conf.cache:
+		jobs.save(filename)
+	return jobs, key
+
+
+def workload_key(workload, parser, serial, submitter):
+	"""
+	Return a hash of the workload content and the settings
+	used to prepare the jobs.
+
+	The hash also covers the code preparing the jobs: the modules
+	of the parser and the submitter classes (with their base
+	classes) and of the `JobTable`.
+	"""
+	classes = (type(parser).__mro__ + type(submitter).__mro__ +
+		   (JobTable,))
+	files = set(inspect.getsourcefile(cl) for cl in classes
+		    if cl is not object)
+	h = hashlib.sha1()
+	hash_file(h, workload)
+	h.update(source_key(sorted(files)))
+	h.update(repr((JobTable.COLUMNS, str(parser), serial,
+		       submitter.__class__.__name__,
+		       sorted(submitter.settings_used().items()))))
+	return h.hexdigest()
 
 
 def setup_logging(debug, config=""):
@@ -321,47 +555,91 @@ def run(workload, args):
 
 	Run one simulation for each supplied ``scheduler``.
 	"""
+	simulate(workload, [args])
 
-	multi_sched = len(args['schedulers']) > 1
-	multi_blocks = args['block_time'] and not args['one_block']
 
-	run_async = not PROFILE_FLAG and (multi_sched or multi_blocks)
+def sweep(workload, args):
+	"""
+	Run the simulations for each combination of the values
+	from the ``grid`` in `args` on the `workload`.
 
-	if run_async:
-		# Prepare the worker pool. Leave one CPU free,
-		# so the operating system can stay responsive.
-		my_pool = multiprocessing.Pool(multiprocessing.cpu_count() - 1)
+	The remaining `args` are the same for all the simulations.
+	The title of each simulation gets a ``-pN`` suffix, where N
+	is the number of the combination.
+	"""
+	templates = {temp.name: temp for temp in settings.sim_templates +
+		     settings.alg_templates + settings.part_templates}
+	names, values = [], []
+
+	for grid in args.pop('grid'):
+		name = grid[0]
+		if name not in templates or name == 'title':
+			raise Exception('invalid grid setting %s' % name)
+		if name in WORKLOAD_SETTINGS:
+			raise Exception('setting %s is the same for the whole'
+					' sweep' % name)
+		temp = templates[name]
+		to_value = template_type(temp)
+		if isinstance(temp.default, list):
+			# one value for each simulation
+			grid_values = [[to_value(v)] for v in grid[1:]]
+		else:
+			grid_values = [to_value(v) for v in grid[1:]]
+		names.append(name)
+		values.append(grid_values)
+
+	points = []
+	for num, point_values in enumerate(itertools.product(*values)):
+		point = dict(args)
+		point.update(zip(names, point_values))
+		point['title'] = '{}-p{}'.format(args['title'], num)
+		logging.info('Simulation {}: {}'.format(point['title'],
+			dict(zip(names, point_values))))
+		points.append(point)
+
+	simulate(workload, points)
+
+
+def simulate(workload, points):
+	"""
+	Run the simulations described in the list of `points` (each
+	with the ``run`` arguments) on the `workload`.
+
+	The workload is prepared only once, so the `WORKLOAD_SETTINGS`
+	must be the same for all the simulations. One result file is
+	created for each simulation and ``scheduler``.
+
+	With ``cache_results``, the result of each block simulation is
+	kept in the ``cache`` directory (see `result_key`), so only the
+	missing blocks are simulated when the simulation is repeated.
+	"""
+	for name in WORKLOAD_SETTINGS:
+		if any(args[name] != points[0][name] for args in points):
+			raise Exception('different %s values' % name)
 
 	# encapsulate different settings
-	sim_conf = settings.Settings(settings.sim_templates, **args)
-	alg_conf = settings.Settings(settings.alg_templates, **args)
-	part_conf = settings.Settings(settings.part_templates, **args)
+	confs = []
+	for args in points:
+		sim_conf = settings.Settings(settings.sim_templates, **args)
+		alg_conf = settings.Settings(settings.alg_templates, **args)
+		part_conf = settings.Settings(settings.part_templates, **args)
+
+		# now we need to load and instantiate the classes from `part_conf`
+		for key, value in part_conf.__dict__.items():
+			setattr(part_conf, key, make_classes(value, alg_conf))
+
+		confs.append((sim_conf, alg_conf, part_conf))
+
+	sim_conf, alg_conf, part_conf = confs[0]
 
 	# before we start, check the output directory
 	if not os.path.isdir(sim_conf.output):
 		raise Exception('invalid output directory %s' % sim_conf.output)
 
-	# now we need to load and instantiate the classes from `part_conf`
-	for key, value in part_conf.__dict__.items():
-		setattr(part_conf, key, make_classes(value, alg_conf))
-
 	# parse the workload
-	parser = parsers.get_parser(workload)
-
-	jobs, users = parser.parse_workload(workload, sim_conf.serial)
-	jobs.sort(key=lambda j: j.submit)  # order by submit time
-
-	# set job time limit and validate run time
-	killed = 0
-	for j in jobs:
-		j.time_limit = part_conf.submitter.time_limit(j)
-		if j.run_time > j.time_limit:
-			j.run_time = j.time_limit
-			killed += 1
-	
-	if killed:
-		logging.warn('%s jobs will end prematurely due to insufficient'
-		             ' time limit' % killed)
+	jobs, jobs_key = prepare_jobs(workload, sim_conf, part_conf)
+	keep = jobs_key is not None and sim_conf.cache_results
+	users = jobs.users
 
 	# set user shares
 	shares = {}
@@ -383,78 +661,138 @@ def run(workload, args):
 		else:
 			blocks = [ blocks[sim_conf.block_number] ]
 
-	results = {sched: [] for sched in part_conf.schedulers}
+	# calculate the CPU number of each block in each simulation
+	cpus = []
+	percentiles = {}
+	for sim_conf, _, _ in confs:
+		if sim_conf.cpu_count:
+			cpus.append([sim_conf.cpu_count] * len(blocks))
+		else:
+			percent = sim_conf.cpu_percent
+			if percent not in percentiles:
+				percentiles[percent] = [cpu_percentile(bl, percent)
+							for bl in blocks]
+			cpus.append(percentiles[percent])
+
+	# simulation tasks <point, block, scheduler>
+	tasks = [(p, i, j) for p, (_, _, part_conf) in enumerate(confs)
+		 for i in range(len(blocks))
+		 for j in range(len(part_conf.schedulers))]
+
 	global_start = time.time()
+	time_stamp = time.localtime(global_start)
+
+	# the result file of each simulation and scheduler
+	filenames = {}
+	for p, (sim_conf, _, part_conf) in enumerate(confs):
+		for sched in part_conf.schedulers:
+			title = sim_conf.title
+			if sim_conf.one_block:
+				title += '-b%s' % sim_conf.block_number
+
+			filename = '{}-{}-{}'.format(
+				title,
+				sched,
+				time.strftime('%b%d_%H-%M', time_stamp)
+			)
+			filenames[p, sched] = os.path.join(sim_conf.output, filename)
+
+	# the file with the events of each task
+	part_files = {}
+	cached = {}  # the diagnostic statistics of the cached results
+	for p, i, j in tasks:
+		sched = confs[p][2].schedulers[j]
+		if not keep:
+			filename = '{}.part{}'.format(filenames[p, sched], i)
+		else:
+			key = result_key(jobs_key, blocks[i], cpus[p][i],
+					 sched, points[p])
+			filename = os.path.join(confs[p][0].cache, key)
+			diag = load_result(filename)
+			if diag is not None:
+				cached[p, i, sched] = diag
+		part_files[p, i, sched] = filename
+
+	if cached:
+		logging.info('Reusing %s cached block results' % len(cached))
+	tasks = [(p, i, j) for p, i, j in tasks
+		 if (p, i, confs[p][2].schedulers[j]) not in cached]
+
+	run_async = not PROFILE_FLAG and len(tasks) > 1
+
+	# Share the blocks with the workers, the job tables
+	# are not copied until they are modified.
+	SHARED.update(blocks=blocks, confs=confs, cpus=cpus)
+
+	if run_async:
+		# Prepare the worker pool. Leave one CPU free,
+		# so the operating system can stay responsive.
+		workers = max(multiprocessing.cpu_count() - 1, 1)
+		my_pool = multiprocessing.Pool(workers)
+
+		# Start with the most expensive blocks, so the workers
+		# are not left idle waiting for one long block at the end.
+		tasks.sort(key=lambda task: blocks[task[1]].cost(
+				cpus[task[0]][task[1]]), reverse=True)
 
 	print '-' * 50
 	logging.info('Simulation started. Block count %s' % len(blocks))
 
-	for bl in blocks:
-		# calculate the CPU number
-		if sim_conf.cpu_count:
-			cpus = sim_conf.cpu_count
+	results = {}
+	for p, i, j in tasks:
+		sched = confs[p][2].schedulers[j]
+		params = (p, i, j, part_files[p, i, sched], keep)
+		if run_async:
+			results[p, i, sched] = my_pool.apply_async(simulate_shared,
+								   params)
 		else:
-			cpus = cpu_percentile(bl, sim_conf.cpu_percent)
-
-		bl.cpus = cpus
+			results[p, i, sched] = simulate_shared(*params)
 
+	# join the block results in order, as soon as they are ready
+	for p, (sim_conf, _, part_conf) in enumerate(confs):
+		files = {}
 		for sched in part_conf.schedulers:
-			params = (bl, sched, alg_conf, part_conf)
-
-			if run_async:
-				async_r = my_pool.apply_async(simulate_block, params)
-				results[sched].append(async_r)
-			else:
-				r = simulate_block(*params)
-				results[sched].append(r)
+			f = open(filenames[p, sched], 'w')
+			f.write('# Description of the output can be found in'
+				' core/simulator.py in the GeneralSimulator._store_X'
+				' methods\n')
+			f.write('%s\n' % points[p])  # original arguments
+			f.write('SIMULATION START %s\n' % time.ctime(global_start))
+			files[sched] = f
+
+		for i, bl in enumerate(blocks):
+			bl.cpus = cpus[p][i]
+			for sched in part_conf.schedulers:
+				if sim_conf.cpu_count:
+					m = '{0} : {1}'
+				else:
+					m = '{0} ({2}-th percentile) : {1}'
+				logging.info(m.format(bl, sched, sim_conf.cpu_percent))
+
+				if (p, i, sched) in cached:
+					diag = cached.pop((p, i, sched))
+				elif run_async:
+					sim_result = results.pop((p, i, sched))
+					# ctr-c doesn't seem to work without a timeout
+					sim_result.wait(60*60*24*365)
+					diag = sim_result.get(5)
+				else:
+					diag = results.pop((p, i, sched))
+
+				print_stats(diag)
+				# copy partial results to file
+				f = files[sched]
+				f.write('BLOCK START %s\n' % bl.cpus)
+				with open(part_files[p, i, sched]) as part:
+					shutil.copyfileobj(part, f)
+				if not keep:
+					os.remove(part_files[p, i, sched])
+				f.write('BLOCK END %s\n' % diag.__dict__)
 
-	# wait for the asynchronous results
-	if run_async:
-		for sched_results in results.itervalues():
-			for sim_result in sched_results:
-				# ctr-c doesn't seem to work without a timeout
-				sim_result.wait(60*60*24*365)
-
-	for sched, sched_results in results.iteritems():
-		time_stamp = time.localtime(global_start)
-
-		title = sim_conf.title
-		if sim_conf.one_block:
-			title += '-b%s' % sim_conf.block_number
-
-		filename = '{}-{}-{}'.format(
-			title,
-			sched,
-			time.strftime('%b%d_%H-%M', time_stamp)
-		)
-		filename = os.path.join(sim_conf.output, filename)
-
-		f = open(filename, 'w')
-		f.write('# Description of the output can be found in core/simulator.py'
-		        ' in the GeneralSimulator._store_X methods\n')
-		f.write('%s\n' % args)  # original arguments
-		f.write('SIMULATION START %s\n' % time.ctime(global_start))
-
-		for i, sim_result in enumerate(sched_results):
-			if sim_conf.cpu_count:
-				m = '{0} : {1}'
-			else:
-				m = '{0} ({2}-th percentile) : {1}'
-			logging.info(m.format(blocks[i], sched, sim_conf.cpu_percent))
-
-			if run_async:
-				r, diag = sim_result.get(5)
-			else:
-				r, diag = sim_result
-
-			print_stats(diag)
-			# save partial results to file
-			f.write('BLOCK START %s\n' % blocks[i].cpus)
-			f.write(zlib.decompress(r))
-			f.write('BLOCK END %s\n' % diag.__dict__)
-		f.close()
-
-		logging.info('Results saved to file %s' % filename)
+		for sched in part_conf.schedulers:
+			files[sched].close()
+			logging.info('Results saved to file %s'
+				     % filenames[p, sched])
 		print '-' * 50
 
 	logging.info('Simulation completed. Total run time %.2f'
@@ -526,6 +864,7 @@ def config(args):
 
 
 run_opts = '[SIM_OPTS][ALG_OPTS][PART_OPTS] workload_file'
+sweep_opts = '--grid NAME VALUE [VALUE ...] [...] ' + run_opts
 
 global_desc = """INSTRUCTIONS
 ----------------------------------------------------------------
@@ -533,18 +872,21 @@ To run a cluster simulation:
     `%(prog)s run {}`
 To read the options from a config file:
     `%(prog)s run @myconfig workload_file`
+To run a simulation for each combination of the setting values:
+    `%(prog)s sweep {}`
 
 You can generate a template of the configuration:
     `%(prog)s config --generate`.
 You can also recreate a config from a simulation:
     `%(prog)s config --recreate sim_file`
 ----------------------------------------------------------------
-""".format(run_opts)
+""".format(run_opts, sweep_opts)
 
 
-def arguments_from_templates(parser, templates):
+def template_type(temp):
 	"""
-	Add arguments to the parser based on the `Template` list.
+	Return a function converting a string to a `Template` value.
+	For multiple values convert a single element.
 	"""
 
 	def str2bool(v):
@@ -558,24 +900,31 @@ def arguments_from_templates(parser, templates):
 			raise argparse.ArgumentTypeError('negative value')
 		return v
 
+	ftypes = {bool: str2bool,
+		  int: functools.partial(positive, int),
+		  float: functools.partial(positive, float),
+		  str: str}
+
+	if isinstance(temp.default, list):
+		return ftypes[type(temp.default[0])]
+	return ftypes[type(temp.default)]
+
+
+def arguments_from_templates(parser, templates):
+	"""
+	Add arguments to the parser based on the `Template` list.
+	"""
 	for temp in templates:
 		assert temp.default is not None, 'invalid default value'
 
 		opts = {'metavar': temp.time_unit,
 			'default': temp.default,
-			'help': temp.desc}
-
-		ftypes = {bool: str2bool,
-			  int: functools.partial(positive, int),
-			  float: functools.partial(positive, float),
-			  str: str}
+			'help': temp.desc,
+			'type': template_type(temp)}
 
 		if isinstance(temp.default, list):
 			# multiple values
-			opts['type'] = ftypes[type(temp.default[0])]
 			opts['nargs'] = '*'
-		else:
-			opts['type'] = ftypes[type(temp.default)]
 
 		parser.add_argument('--' + temp.name, **opts)
 
@@ -621,20 +970,33 @@ if __name__=="__main__":
 					   usage='%(prog)s {}'.format(run_opts),
 					   fromfile_prefix_chars='@',
 					   formatter_class=MyHelpFormatter)
-	run_parser.add_argument('--profile', action='store_true',
-				help='Run a time profiler instead of the normal simulation')
-	run_parser.add_argument('--debug', action='store_true',
-				help='Set the logger level to DEBUG')
-	run_parser.add_argument('workload', help='The workload file')
-
-	sim_group = run_parser.add_argument_group('General simulation parameters')
-	arguments_from_templates(sim_group, settings.sim_templates)
 
-	alg_group = run_parser.add_argument_group('Algorithm specific parameters')
-	arguments_from_templates(alg_group, settings.alg_templates)
-
-	part_group = run_parser.add_argument_group('Part selection parameters')
-	arguments_from_templates(part_group, settings.part_templates)
+	# sweep simulations parser
+	sweep_parser = subparsers.add_parser('sweep',
+					     help='Run a simulation for each'
+					     ' combination of the setting values',
+					     usage='%(prog)s {}'.format(sweep_opts),
+					     fromfile_prefix_chars='@',
+					     formatter_class=MyHelpFormatter)
+	sweep_parser.add_argument('--grid', nargs='+', action='append',
+				  required=True, metavar=('NAME', 'VALUE'),
+				  help='A setting and the values to simulate')
+
+	for sim_parser in [run_parser, sweep_parser]:
+		sim_parser.add_argument('--profile', action='store_true',
+					help='Run a time profiler instead of the normal simulation')
+		sim_parser.add_argument('--debug', action='store_true',
+					help='Set the logger level to DEBUG')
+		sim_parser.add_argument('workload', help='The workload file')
+
+		sim_group = sim_parser.add_argument_group('General simulation parameters')
+		arguments_from_templates(sim_group, settings.sim_templates)
+
+		alg_group = sim_parser.add_argument_group('Algorithm specific parameters')
+		arguments_from_templates(alg_group, settings.alg_templates)
+
+		part_group = sim_parser.add_argument_group('Part selection parameters')
+		arguments_from_templates(part_group, settings.part_templates)
 
 	# config parser
 	config_parser = subparsers.add_parser('config', help='Create configuration')
@@ -647,13 +1009,16 @@ if __name__=="__main__":
 
 	args = vars(parser.parse_args())
 
-	if args['command'] == 'run':
+	if args['command'] in ['run', 'sweep']:
 		# setup mode of execution
 		PROFILE_FLAG = args.pop('profile')
-		config_filename = [arg[1:] for arg in sys.argv if arg[0]=='@'][0]
+		config_filename = [arg[1:] for arg in sys.argv if arg[:1] == '@'][0]
 		setup_logging(PROFILE_FLAG and args.pop('debug'), config_filename)
 		# and go!
-		run(args['workload'], args)
+		if args['command'] == 'run':
+			run(args['workload'], args)
+		else:
+			sweep(args['workload'], args)
 	elif args['command'] == 'config':
 		config(args)
 	else:
@@ -119,11 +119,11 @@ class PreviousNEstimator(BaseEstimator):
 		Set the time limit to the average of the last N jobs.
 		"""
 		N = self._settings.last_completed
+		last_runtimes = job.user.recent_run_times
+		assert last_runtimes.size == N, 'invalid run time window'
 
-		if len(job.user.completed_jobs) >= N:
-			last_runtimes = [ j.run_time for j in job.user.completed_jobs[-N:] ]
-			assert len(last_runtimes) == N, 'missing jobs'
-			return sum(last_runtimes) / N
+		if last_runtimes.full:
+			return last_runtimes.total / N
 		else:
 			return job.time_limit
 
@@ -25,12 +25,28 @@ class BaseScheduler(object):
 	  or the user/system CPU usage, respectively.
 	  This can result in about 10%-30% faster simulation.
 
+	  Similarly, set `static_keys` if the job keys only change
+	  on the events modifying the owner campaigns (job submission,
+	  job end, new estimate and campaign end). The keys of other
+	  jobs are then not recomputed before the scheduling pass.
+	  None of the built-in schedulers sets it, since the Fairshare
+	  keys follow the decayed usage and the OStrich keys follow the
+	  virtual time, which both change between any two passes.
+
+	  If the job keys are shared between groups of jobs (e.g. all
+	  the jobs of a campaign or a user), set `grouped_keys` and
+	  override the `job_group`, `group_priority_key` and `in_group_key`.
+	  The jobs are then ordered by merging the groups, which only
+	  requires the keys of the groups to be recomputed.
+
 	"""
 
 	__metaclass__ = ABCMeta
 
 	only_virtual = False
 	only_real = False
+	static_keys = False
+	grouped_keys = False
 
 	def __init__(self, settings):
 		"""
@@ -45,7 +61,15 @@ class BaseScheduler(object):
 		run time statistics.
 
 		Stats consist of:
-		  cpu_used, active_shares, total_usage.
+		  cpu_used, active_shares, virtual_clock, total_usage, decay_clock.
+
+		The `virtual_clock` is the virtual time received by a single
+		share. It is moved back to zero from time to time, so only
+		the differences between its values are meaningful.
+
+		Note:
+		  The usage values are measured in the units of `decay_clock`
+		  (see `User.usage`), so only their ratios are meaningful.
 		"""
 		self._stats = stats
 
@@ -67,6 +91,32 @@ class BaseScheduler(object):
 		"""
 		raise NotImplemented
 
+	def job_group(self, job):
+		"""
+		Return the group of the job, e.g. the job campaign.
+		Only used if `grouped_keys` is set.
+		"""
+		raise NotImplemented
+
+	def group_priority_key(self, group):
+		"""
+		Create a comparison key for all the jobs in the `group`.
+		Only used if `grouped_keys` is set.
+		"""
+		raise NotImplemented
+
+	def in_group_key(self, job):
+		"""
+		Create a comparison key for the job inside its group.
+		The key **MUST NOT** change while the job is pending.
+		Only used if `grouped_keys` is set.
+
+		Note:
+		  The `job_priority_key` has to be equal to the
+		  `group_priority_key` followed by the `in_group_key`.
+		"""
+		raise NotImplemented
+
 	def __str__(self):
 		return self.__class__.__name__
 
@@ -77,6 +127,7 @@ class OStrich(BaseScheduler):
 	"""
 
 	only_virtual = True
+	grouped_keys = True
 
 	def job_priority_key(self, job):
 		"""
@@ -90,14 +141,26 @@ class OStrich(BaseScheduler):
 		Inside campaigns order by shorter run time estimate.
 		In case of ties order by earlier submit.
 		"""
-		camp, user = job.camp, job.user
+		return (self.group_priority_key(job.camp) +
+			self.in_group_key(job))
+
+	def job_group(self, job):
+		return job.camp
+
+	def group_priority_key(self, camp):
+		"""
+		The campaign part of the key (points 1-3).
+		"""
+		user = camp.user
 		end = camp.time_left / user.shares  # lower value -> higher priority
 		# The `end` should be further multiplied by
 		#   `_stats.active_shares` / `_stats.cpu_used`.
 		# However, that gives the same value for all the jobs
 		# and we only need the ordering, not the absolute value.
-		return (end, camp.created, user.ID, camp.ID,
-			job.estimate, job.submit, job.ID)
+		return (end, camp.created, user.ID, camp.ID)
+
+	def in_group_key(self, job):
+		return (job.estimate, job.submit, job.ID)
 
 
 class Fairshare(BaseScheduler):
@@ -108,6 +171,7 @@ class Fairshare(BaseScheduler):
 	"""
 
 	only_real = True
+	grouped_keys = True
 
 	def job_priority_key(self, job):
 		"""
@@ -128,14 +192,27 @@ class Fairshare(BaseScheduler):
 		  The new formula is as follows:
 		    pow(2.0, -((usage_efctv / shares_norm) / damp_factor))
 		"""
+		return (self.group_priority_key(job.user) +
+			self.in_group_key(job))
+
+	def job_group(self, job):
+		return job.user
+
+	def group_priority_key(self, user):
+		"""
+		The owner part of the key (the fairshare priority).
+		"""
 		if not self._stats.total_usage:
 			fairshare = 1
 		else:
-			user = job.user
-			effective = user.cpu_clock_used / self._stats.total_usage
+			usage = user.usage(self._stats.decay_clock)
+			effective = usage / self._stats.total_usage
 			#shares_norm = user.shares  # already normalized
 			fairshare = 2.0 ** -(effective / user.shares)
 		prio = int(fairshare * 100000)  # higher value -> higher priority
 		# TODO if needed change the constant to a configuration setting
 		# TODO and add more components to the priority value
-		return (-prio, job.submit, job.ID)
+		return (-prio,)
+
+	def in_group_key(self, job):
+		return (job.submit, job.ID)
@@ -65,6 +65,14 @@ alg_templates = [
 	Template('bf_window', 'The amount of time to look into the future'
 		 ' when considering jobs for backfilling', 24, 'HOURS'),
 	Template('bf_interval', 'The time between backfilling iterations', 5, 'MINS'),
+	Template('manager', 'The cluster manager class from core.cluster_managers'
+		 ' (BaseManager, TreeManager, EasyManager). TreeManager is'
+		 ' only faster with several hundred jobs running at once',
+		 'BaseManager'),
+	Template('keep_completed', 'Keep all the completed jobs and campaigns'
+		 ' until the end of the simulation. Otherwise the CAMP END'
+		 ' records are stored when the campaigns are released, in'
+		 ' between the records of other campaigns', True),
 ]
 
 # You can change the default classes here.
@@ -90,6 +98,10 @@ sim_templates = [
 	Template('cpu_count', 'Set a static number of CPUs, takes precedence', 0),
 	Template('cpu_percent', 'Set the number of CPUs to the P-th percentile', 70),
 	Template('output', 'Directory to store the results in', 'sim_results'),
+	Template('cache', 'Directory to cache the prepared workloads in,'
+		 ' empty to turn off', 'workload_cache'),
+	Template('cache_results', 'Also cache the block results and reuse'
+		 ' them in the same simulations', False),
 ]
 
 
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import numpy as np
 from abc import ABCMeta, abstractmethod
 
 """
@@ -19,6 +20,9 @@ class BaseSubmitter(object):
 
 	1) _get_limit
 
+	Subclasses can also override `_get_limits` to compute
+	the time limits of all the jobs at once.
+
 	You can access the `Settings` using `self._settings`.
 	"""
 
@@ -30,6 +34,13 @@ class BaseSubmitter(object):
 		"""
 		self._settings = settings
 
+	def settings_used(self):
+		"""
+		Return a dictionary with the settings affecting the time limits.
+		Used to identify the cached workloads, by default all the settings.
+		"""
+		return vars(self._settings)
+
 	def time_limit(self, job):
 		"""
 		Public wrapper method.
@@ -42,6 +53,19 @@ class BaseSubmitter(object):
 		assert limit > 0, 'invalid time limit'
 		return limit
 
+	def time_limits(self, jobs):
+		"""
+		Public wrapper method.
+		Run and check the correctness of `_get_limits`.
+		"""
+		prev = jobs.time_limit.copy()
+		limits = self._get_limits(jobs)
+		assert np.array_equal(jobs.time_limit, prev), \
+		  'time limit was changed'
+		assert len(limits) == len(jobs), 'invalid time limit count'
+		assert (limits > 0).all(), 'invalid time limit'
+		return limits
+
 	@abstractmethod
 	def _get_limit(self, job):
 		"""
@@ -52,32 +76,62 @@ class BaseSubmitter(object):
 		"""
 		raise NotImplemented
 
+	def _get_limits(self, jobs):
+		"""
+		Return an array with the time limits of the jobs
+		in the `JobTable`, calls `time_limit` for each job.
+
+		Note:
+		  **DO NOT** set the `jobs.time_limit` yourself.
+		"""
+		limits = [self.time_limit(job) for job in jobs.iter_jobs()]
+		return np.array(limits, dtype=np.int64)
+
 
 class OracleSubmitter(BaseSubmitter):
 	"""
 	A submitter that perfectly predicts the real run time.
 	"""
 
+	def settings_used(self):
+		return {}
+
 	def _get_limit(self, job):
 		return job.run_time
 
+	def _get_limits(self, jobs):
+		return jobs.run_time.copy()
+
 
 class FromWorkloadSubmitter(BaseSubmitter):
 	"""
 	Use the values from the workload file.
 	"""
 
+	def settings_used(self):
+		return {}
+
 	def _get_limit(self, job):
 		if job.time_limit:
 			return job.time_limit
 		else:  # time limit is missing
 			return job.run_time
 
+	def _get_limits(self, jobs):
+		return np.where(jobs.time_limit > 0, jobs.time_limit, jobs.run_time)
+
 class DefaultTimeSubmitter(BaseSubmitter):
 	"""
 	Always return a predefined valued.
 	Uses `_settings.default_limit` as that value.
 	"""
 
+	def settings_used(self):
+		return {'default_limit': self._settings.default_limit}
+
 	def _get_limit(self, job):
 		return self._settings.default_limit
+
+	def _get_limits(self, jobs):
+		return np.full(len(jobs), self._settings.default_limit,
+			       dtype=np.int64)
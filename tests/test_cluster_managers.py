@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+import itertools
+import random
+import unittest
+from core.cluster_managers import BaseManager, EasyManager, TreeManager, \
+  _TreeSpace, _insert, _remove, _add_range, _last_below, _push
+
+
+class _Settings(object):
+
+	def __init__(self, bf_window):
+		self.bf_window = bf_window
+
+
+class _Job(object):
+
+	def __init__(self, ID, proc, time_limit, run_time):
+		self.ID = ID
+		self.proc = proc
+		self.time_limit = time_limit
+		self.run_time = run_time
+		self.start_time = self.end_time = None
+
+	def __repr__(self):
+		return 'Job {} proc {} limit {}'.format(
+			self.ID, self.proc, self.time_limit)
+
+
+class _Profile(object):
+	"""
+	The CPU availability computed from all the allocated intervals.
+	"""
+
+	def __init__(self, cpus):
+		self.cpus = cpus
+		self.used = []  # <begin, end, proc>
+
+	def avail(self, t):
+		return self.cpus - sum(proc for begin, end, proc in self.used
+				       if begin <= t < end)
+
+	def fits(self, begin, end, proc):
+		# the availability only changes at the interval bounds
+		points = set([begin])
+		for b, e, _ in self.used:
+			points.update(t for t in (b, e) if begin <= t < end)
+		return all(self.avail(t) >= proc for t in points)
+
+	def earliest_start(self, now, window, job):
+		"""
+		Return the earliest start up to `window` or `None`.
+		"""
+		# a job can only start later when some CPUs are freed
+		starts = set([now])
+		starts.update(e for _, e, _ in self.used if now < e <= window)
+		for begin in sorted(starts):
+			if self.fits(begin, begin + job.time_limit, job.proc):
+				return begin
+		return None
+
+
+class BaseManagerTest(unittest.TestCase):
+	"""
+	Compare the manager with the availability computed from
+	the allocated intervals, in random scheduling sessions.
+	"""
+
+	manager_class = BaseManager
+
+	def run_sessions(self, seed, cpus=20, sessions=400):
+		rand = random.Random(seed)
+		window = rand.choice([50, 200, 1000])
+		manager = self.manager_class(cpus, _Settings(window))
+		profile = _Profile(cpus)
+		running = {}  # job -> interval in the profile
+		waiting = []
+		ids = itertools.count()
+		now = 0
+
+		for _ in xrange(sessions):
+			for _ in xrange(rand.randint(0, 4)):
+				limit = rand.randint(1, 300)
+				job = _Job(next(ids), rand.randint(1, cpus),
+					   limit, rand.randint(1, limit))
+				waiting.append(job)
+
+			# end the jobs in the order of the end times
+			ended = sorted((job for job in running
+					if job.end_time <= now),
+				       key=lambda job: (job.end_time, job.ID))
+			for job in ended:
+				manager.job_ended(job)
+				profile.used.remove(running.pop(job))
+
+			bf_mode = rand.random() < 0.7
+			manager.start_session(now)
+			reserved = []
+			started = []
+			# only the first jobs, like with the `bf_depth`
+			for job in waiting[:30]:
+				if bf_mode:
+					begin = profile.earliest_start(
+						now, now + window, job)
+					result = manager.try_backfill(job)
+				else:
+					begin = now if profile.fits(
+						now, now + job.time_limit,
+						job.proc) else None
+					result = manager.try_schedule(job)
+				self.assertEqual(result, begin == now)
+				if begin is not None:
+					interval = (begin, begin + job.time_limit,
+						    job.proc)
+					profile.used.append(interval)
+				if result:
+					job.start_time = now
+					job.end_time = now + job.run_time
+					running[job] = interval
+					started.append(job)
+				elif begin is not None:
+					reserved.append(interval)
+				elif not bf_mode:
+					break
+			manager.end_session()
+
+			for interval in reserved:
+				profile.used.remove(interval)
+			for job in started:
+				waiting.remove(job)
+			# the next event, a job end or a submission
+			ends = [job.end_time for job in running
+				if job.end_time > now]
+			now = min(ends + [now + rand.randint(1, 100)])
+
+		self.assertTrue(manager.tested > 0)
+
+	def test_random_sessions(self):
+		for seed in xrange(5):
+			self.run_sessions(seed)
+
+	def test_many_cpus(self):
+		self.run_sessions(10, cpus=200)
+
+
+class TreeManagerTest(BaseManagerTest):
+
+	manager_class = TreeManager
+
+
+class _EasyManager(EasyManager):
+	"""
+	Remembers the jobs considered for the reservation.
+	"""
+
+	def start_session(self, now):
+		EasyManager.start_session(self, now)
+		self.reserved = []
+
+	def _reserve(self, job):
+		self.reserved.append(job)
+		EasyManager._reserve(self, job)
+
+
+class EasyManagerTest(unittest.TestCase):
+	"""
+	Check the EASY rules with the availability computed from
+	the allocated intervals, in random backfilling sessions.
+	"""
+
+	def run_sessions(self, seed, cpus=20, sessions=400):
+		rand = random.Random(seed)
+		window = rand.choice([50, 200, 1000])
+		manager = _EasyManager(cpus, _Settings(window))
+		profile = _Profile(cpus)
+		running = {}  # job -> interval in the profile
+		waiting = []
+		ids = itertools.count()
+		now = 0
+		inf = float('inf')
+
+		for _ in xrange(sessions):
+			for _ in xrange(rand.randint(0, 4)):
+				limit = rand.randint(1, 300)
+				job = _Job(next(ids), rand.randint(1, cpus),
+					   limit, rand.randint(1, limit))
+				waiting.append(job)
+
+			ended = sorted((job for job in running
+					if job.end_time <= now),
+				       key=lambda job: (job.end_time, job.ID))
+			for job in ended:
+				manager.job_ended(job)
+				profile.used.remove(running.pop(job))
+
+			manager.start_session(now)
+			head = shadow = None
+			started = []
+			for job in waiting[:30]:
+				fits = profile.fits(now, now + job.time_limit,
+						    job.proc)
+				result = manager.try_backfill(job)
+				if head is None and not fits:
+					# the first job that doesn't fit is reserved
+					head = job
+					shadow = profile.earliest_start(now, inf, job)
+					if shadow > now + window:
+						shadow = None
+				if fits and (shadow is None or
+					     now + job.time_limit <= shadow):
+					self.assertTrue(result)
+				if result:
+					self.assertTrue(fits)
+					interval = (now, now + job.time_limit,
+						    job.proc)
+					profile.used.append(interval)
+					job.start_time = now
+					job.end_time = now + job.run_time
+					running[job] = interval
+					started.append(job)
+			manager.end_session()
+
+			# at most one job is reserved in a pass
+			self.assertEqual(manager.reserved,
+					 [] if head is None else [head])
+			if shadow is not None:
+				# the started jobs don't delay the reserved job
+				self.assertEqual(profile.earliest_start(
+					now, inf, head), shadow)
+			for job in started:
+				waiting.remove(job)
+			ends = [job.end_time for job in running
+				if job.end_time > now]
+			now = min(ends + [now + rand.randint(1, 100)])
+
+		self.assertTrue(manager.tested > 0)
+
+	def test_random_sessions(self):
+		for seed in xrange(5):
+			self.run_sessions(seed)
+
+	def test_many_cpus(self):
+		self.run_sessions(10, cpus=200)
+
+
+class TreapTest(unittest.TestCase):
+	"""
+	Compare the treap with a dictionary of the space begins.
+	"""
+
+	def walk(self, node, low, high, out):
+		"""
+		Check the treap invariants and collect the spaces in order.
+		Return the lowest `avail` in the subtree.
+		"""
+		if node is None:
+			return float('inf')
+		self.assertTrue(low <= node.begin < high)
+		_push(node)
+		for child in (node.left, node.right):
+			if child is not None:
+				self.assertTrue(child.prio <= node.prio)
+		lowest = min(self.walk(node.left, low, node.begin, out),
+			     node.avail)
+		out.append((node.begin, node.avail))
+		lowest = min(self.walk(node.right, node.begin, high, out),
+			     lowest)
+		self.assertEqual(node.min_avail, lowest)
+		return lowest
+
+	def test_random_operations(self):
+		rand = random.Random(0)
+		root = _TreeSpace(0, 0, 2.0)  # never removed
+		ref = {0: 0}  # begin -> avail
+
+		for _ in xrange(5000):
+			op = rand.random()
+			t = rand.randint(1, 200)
+			if op < 0.3:
+				if t not in ref:
+					# a new space splits the one containing `t`
+					ref[t] = ref[max(b for b in ref if b < t)]
+					root = _insert(root, _TreeSpace(
+						t, ref[t], rand.random()))
+			elif op < 0.5:
+				if t in ref:
+					root = _remove(root, t)
+					del ref[t]
+			elif op < 0.8:
+				end = t + rand.randint(0, 100)
+				value = rand.randint(-10, 10)
+				_add_range(root, float('-inf'), float('inf'),
+					   t, end, value)
+				for b in ref:
+					if t <= b < end:
+						ref[b] += value
+			else:
+				end = t + rand.randint(0, 100)
+				proc = rand.randint(-20, 20)
+				below = [b for b in ref
+					 if t <= b < end and ref[b] < proc]
+				self.assertEqual(_last_below(root, t, end, proc),
+						 max(below) if below else None)
+			out = []
+			self.walk(root, float('-inf'), float('inf'), out)
+			self.assertEqual(out, sorted(ref.items()))
+
+
+if __name__ == '__main__':
+	unittest.main()
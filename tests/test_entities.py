@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import itertools
+import random
+import unittest
+from core.entities import Job, RunTimeWindow, User
+
+
+class UserTest(unittest.TestCase):
+	"""
+	Compare the campaign time left with the sums of the workloads.
+	"""
+
+	def check_user(self, user, workloads, virtual):
+		prefix, total = [], 0
+		for value in workloads:
+			total += value
+			prefix.append(total)
+		for camp in itertools.chain(user.completed_camps, user.active_camps):
+			left = prefix[camp.ID] - int(virtual)
+			self.assertEqual(camp.time_left, max(left, 0))
+			self.assertEqual(camp.workload, workloads[camp.ID])
+		# the campaigns are completed in the creation order
+		ids = [camp.ID for camp in user.completed_camps]
+		ids += [camp.ID for camp in user.active_camps]
+		self.assertEqual(ids, range(len(workloads)))
+
+	def complete_camps(self, user):
+		# the same as after the virtual work in the simulator
+		while user.active_camps and not user.active_camps[0].time_left:
+			user.completed_camps.append(user.active_camps.popleft())
+
+	def test_random_operations(self):
+		rand = random.Random(0)
+		user = User(0)
+		user.reset()
+		ids = itertools.count()
+		workloads = []  # of the campaigns in the creation order
+		virtual = lost = 0
+		pending, running = [], []
+
+		for now in xrange(3000):
+			op = rand.random()
+			if op < 0.1 or not workloads:
+				user.create_campaign(now)
+				workloads.append(0)
+			elif op < 0.35:
+				if user.active_camps:
+					camp = rand.choice(user.active_camps)
+				else:
+					# like the selector, reuse the last campaign
+					camp = user.completed_camps.pop()
+					user.active_camps.append(camp)
+				run_time = rand.randint(0, 100)
+				job = Job(next(ids), now, run_time,
+					  rand.randint(1, 8), 1000, user)
+				job.reset()
+				job.estimate = run_time + rand.randint(0, 50)
+				camp.add_job(job)
+				user.add_job(job)
+				workloads[camp.ID] += job.estimate * job.proc
+				pending.append(job)
+			elif op < 0.5 and pending:
+				job = pending.pop(rand.randrange(len(pending)))
+				job.start_execution(now)
+				running.append(job)
+			elif op < 0.65 and running:
+				job = running.pop(rand.randrange(len(running)))
+				job.execution_ended(job.start_time + job.run_time)
+				workloads[job.camp.ID] += ((job.run_time - job.estimate)
+							   * job.proc)
+			elif op < 0.8 and (pending or running):
+				job = rand.choice(pending + running)
+				value = job.run_time + rand.randint(0, 100)
+				workloads[job.camp.ID] += ((value - job.estimate)
+							   * job.proc)
+				job.next_estimate(value)
+			else:
+				value = rand.random() * 1000
+				user.add_virtual(value)
+				user.virtual_work()
+				virtual += value
+				if virtual > sum(workloads):
+					lost += virtual - sum(workloads)
+					virtual = sum(workloads)
+			self.complete_camps(user)
+			self.check_user(user, workloads, virtual)
+
+		self.assertAlmostEqual(user.lost_virtual, lost, places=3)
+		self.assertTrue(user.completed_camps)
+
+	def test_next_estimate_reactivates(self):
+		user = User(0)
+		user.reset()
+		jobs = []
+		for i in xrange(3):
+			camp = user.create_campaign(i)
+			job = Job(i, i, 10, 1, 100, user)
+			job.reset()
+			job.estimate = 10
+			camp.add_job(job)
+			user.add_job(job)
+			jobs.append(job)
+		user.add_virtual(30)
+		user.virtual_work()
+		self.complete_camps(user)
+		self.assertEqual(len(user.completed_camps), 3)
+
+		jobs[1].next_estimate(15)
+		self.assertEqual([camp.ID for camp in user.active_camps], [1, 2])
+		self.assertEqual([camp.time_left for camp in user.active_camps],
+				 [0, 5])
+		self.check_user(user, [10, 15, 10], 30)
+		self.complete_camps(user)
+		self.assertEqual([camp.ID for camp in user.active_camps], [2])
+
+
+class RunTimeWindowTest(unittest.TestCase):
+	"""
+	Compare the window with the last run times of a list.
+	"""
+
+	def test_wrap_around(self):
+		rand = random.Random(0)
+		for size in (0, 1, 2, 5):
+			window = RunTimeWindow(size)
+			run_times = []
+			for _ in xrange(3 * size + 4):
+				run_times.append(rand.randint(1, 1000))
+				window.add(run_times[-1])
+				last = run_times[-size:] if size else []
+				self.assertEqual(len(window), len(last))
+				self.assertEqual(window.total, sum(last))
+				self.assertEqual(window.full, len(last) == size)
+
+
+if __name__ == '__main__':
+	unittest.main()
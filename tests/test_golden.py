@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+import main
+from core.simulator import GeneralSimulator
+from parts import settings
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def _records(lines):
+	"""
+	Skip the lines that differ between the simulations:
+	the header, the arguments, the start time and the statistics.
+	"""
+	return [line.rstrip('\n') for line in lines
+		if not line.startswith(('#', '{', 'SIMULATION START',
+					'BLOCK END'))]
+
+
+def _without_virtual_stats(records):
+	"""
+	Drop the lost virtual time and the false inactivity period
+	from the user records. The campaign ends are computed in
+	the virtual clock units, without the truncation of the
+	original simulator, so these values differ slightly.
+	"""
+	return [' '.join(line.split()[:4]) if line.startswith('USER ')
+		else line for line in records]
+
+
+class GoldenTest(unittest.TestCase):
+	"""
+	Compare the simulation records on a small workload with
+	the golden files, created by the original simulator (the
+	baseline commit) with the same settings.
+
+	The workload has many users competing for the CPUs and
+	gaps longer than the decay steps, so a change of the job
+	ordering or of the decay shows up in the records.
+	"""
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.args = {temp.name: temp.default for temp in
+			     settings.sim_templates + settings.alg_templates +
+			     settings.part_templates}
+		self.args.update(title='golden', output=self.dir, cache='',
+				 submitter='FromWorkloadSubmitter')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def simulate(self, **kwargs):
+		args = dict(self.args, **kwargs)
+		stdout = sys.stdout
+		sys.stdout = StringIO()
+		try:
+			main.run(os.path.join(DATA_DIR, 'golden.swf'), args)
+		finally:
+			sys.stdout = stdout
+		[filename] = glob.glob(os.path.join(self.dir,
+						    args['title'] + '-*'))
+		with open(filename) as f:
+			return _records(f)
+
+	def golden(self, name):
+		with open(os.path.join(DATA_DIR, name)) as f:
+			return _records(f)
+
+	def assertRecordsEqual(self, records, expected):
+		for i, (line, golden) in enumerate(zip(records, expected)):
+			self.assertEqual(line, golden, 'record {}: {!r} != {!r}'
+					 .format(i, line, golden))
+		self.assertEqual(len(records), len(expected))
+
+	def test_fairshare(self):
+		records = self.simulate(schedulers=['Fairshare'])
+		self.assertRecordsEqual(records,
+					self.golden('golden-Fairshare.txt'))
+
+	def test_ostrich(self):
+		# the new estimates change the campaign workloads
+		records = self.simulate(schedulers=['OStrich'],
+					estimator='PreviousNEstimator')
+		self.assertRecordsEqual(_without_virtual_stats(records),
+					_without_virtual_stats(
+						self.golden('golden-OStrich.txt')))
+
+	def test_virtual_clock_rebase(self):
+		rebases = []
+		limit = GeneralSimulator._MAX_VIRTUAL_CLOCK
+		rebase = GeneralSimulator.__dict__['_rebase_virtual_clock']
+
+		def counted(simulator):
+			rebases.append(simulator._stats.virtual_clock)
+			rebase(simulator)
+
+		GeneralSimulator._MAX_VIRTUAL_CLOCK = 1000
+		GeneralSimulator._rebase_virtual_clock = counted
+		try:
+			records = self.simulate(schedulers=['OStrich'],
+						estimator='PreviousNEstimator')
+		finally:
+			GeneralSimulator._MAX_VIRTUAL_CLOCK = limit
+			GeneralSimulator._rebase_virtual_clock = rebase
+		self.assertTrue(len(rebases) > 10)
+		# the campaign ends are moved with the clock
+		self.assertRecordsEqual(_without_virtual_stats(records),
+					_without_virtual_stats(
+						self.golden('golden-OStrich.txt')))
+
+	def test_keep_completed(self):
+		# the released campaigns only end earlier in the records
+		for scheduler in ('Fairshare', 'OStrich'):
+			kept = self.simulate(schedulers=[scheduler],
+					     title='kept' + scheduler)
+			released = self.simulate(schedulers=[scheduler],
+						 title='released' + scheduler,
+						 keep_completed=False)
+			self.assertNotEqual(released, kept)
+			self.assertEqual(sorted(released), sorted(kept))
+
+			# a campaign ends after all the records of its jobs
+			jobs = {}  # <user, campaign> -> job count
+			for line in released:
+				fields = line.split()
+				if fields[1] == 'JOB':
+					camp = (fields[4], fields[3])
+					jobs[camp] = jobs.get(camp, 0) + 1
+				elif fields[1:3] == ['CAMP', 'END']:
+					camp = (fields[4], fields[3])
+					self.assertEqual(jobs.get(camp, 0),
+							 int(fields[7]), line)
+
+
+if __name__ == '__main__':
+	unittest.main()
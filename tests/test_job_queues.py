@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+from core.job_queues import GroupedQueue, WaitingQueue
+
+
+class _User(object):
+
+	def __init__(self, ID):
+		self.ID = ID
+		self.active_jobs = set()
+
+
+class _Job(object):
+
+	def __init__(self, ID, user, group, value):
+		self.ID = ID
+		self.user = user
+		self.group = group
+		self.value = value
+
+	def __repr__(self):
+		return 'Job {} {}'.format(self.ID, self.group)
+
+
+class _Scheduler(object):
+	"""
+	Groups of jobs with the keys set by the test.
+	"""
+
+	grouped_keys = True
+
+	def __init__(self, static_keys):
+		self.static_keys = static_keys
+		self.keys = {}  # group -> key
+
+	def job_priority_key(self, job):
+		return self.group_priority_key(job.group) + self.in_group_key(job)
+
+	def job_group(self, job):
+		return job.group
+
+	def group_priority_key(self, group):
+		return (self.keys[group],)
+
+	def in_group_key(self, job):
+		return (job.value,)
+
+
+class QueueTest(unittest.TestCase):
+	"""
+	Compare the queue order with the sorted keys of the jobs.
+	Jobs with the same key are ordered by the submission.
+	"""
+
+	def check_queue(self, queue_class, static_keys, limit=None):
+		rand = random.Random(0)
+		sched = _Scheduler(static_keys)
+		queue = queue_class(sched)
+		users = [_User(i) for i in xrange(10)]
+		queued = []  # in the submission order
+
+		for i in xrange(3000):
+			op = rand.random()
+			if op < 0.5:
+				user = rand.choice(users)
+				group = (user.ID, rand.randint(0, 3))
+				sched.keys.setdefault(group, rand.randint(0, 20))
+				job = _Job(i, user, group, rand.randint(0, 5))
+				user.active_jobs.add(job)
+				queue.add(job)
+				queue.invalidate(user)
+				queued.append(job)
+			elif op < 0.7 and queued:
+				job = queued.pop(rand.randrange(len(queued)))
+				job.user.active_jobs.remove(job)
+				queue.remove(job)
+				queue.invalidate(job.user)
+			elif sched.keys:
+				group = rand.choice(sorted(sched.keys))
+				sched.keys[group] = rand.randint(0, 20)
+				queue.invalidate(users[group[0]])
+
+			if rand.random() < 0.3:
+				expected = sorted(queued, key=sched.job_priority_key)
+				if limit is not None:
+					expected = expected[:limit]
+				queue.refresh(limit)
+				jobs = list(queue)
+				if limit is not None:
+					# the jobs after the limit are skipped
+					self.assertLessEqual(len(jobs), limit)
+				self.assertEqual(jobs, expected)
+				self.assertEqual(queue.peek(),
+						 expected[0] if expected else None)
+			self.assertEqual(len(queue), len(queued))
+
+	def test_grouped_queue(self):
+		self.check_queue(GroupedQueue, False)
+
+	def test_grouped_queue_static_keys(self):
+		self.check_queue(GroupedQueue, True)
+
+	def test_waiting_queue(self):
+		self.check_queue(WaitingQueue, False)
+
+	def test_waiting_queue_static_keys(self):
+		self.check_queue(WaitingQueue, True)
+
+	def test_waiting_queue_partial_refresh(self):
+		self.check_queue(WaitingQueue, False, limit=5)
+
+	def test_grouped_queue_partial_refresh(self):
+		self.check_queue(GroupedQueue, False, limit=5)
+
+	def test_grouped_queue_merges_lazily(self):
+		sched = _Scheduler(False)
+		queue = GroupedQueue(sched)
+		sched.keys = {'a': 1, 'b': 0}
+		user = _User(0)
+		jobs = [_Job(i, user, 'ab'[i % 2], i) for i in xrange(6)]
+		for job in jobs:
+			queue.add(job)
+		queue.refresh()
+		it = iter(queue)
+		self.assertEqual([next(it) for _ in xrange(2)], [jobs[1], jobs[3]])
+		# only the keys of the groups are compared, a later
+		# group with a higher priority is considered first
+		sched.keys['a'] = -1
+		queue.refresh()
+		self.assertEqual(list(queue), [jobs[0], jobs[2], jobs[4],
+					       jobs[1], jobs[3], jobs[5]])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import main
+from core.job_table import JobTable
+from core.entities import User
+from parts import submitters
+from parts.submitters import FromWorkloadSubmitter
+
+
+class _Settings(object):
+
+	def __init__(self, **kwargs):
+		self.__dict__.update(kwargs)
+
+
+def _make_table(count):
+	rand = np.random.RandomState(0)
+	users = {uid: User(uid) for uid in xrange(5)}
+	return JobTable(users,
+			ID=np.arange(1, count + 1),
+			submit=rand.randint(0, 50, count),
+			run_time=rand.randint(1, 1000, count),
+			proc=rand.randint(1, 64, count),
+			time_limit=rand.randint(1000, 2000, count),
+			user_id=rand.randint(0, 5, count))
+
+
+# the same submitter with the code in this module
+_ChangedSubmitter = type('FromWorkloadSubmitter',
+			 (submitters.FromWorkloadSubmitter,), {})
+
+
+def _mapped(array):
+	"""
+	Check if the array is a view of a memory-mapped file.
+	"""
+	while array is not None:
+		if isinstance(array, np.memmap):
+			return True
+		array = array.base
+	return False
+
+
+class JobTableTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		logging.disable(logging.WARNING)
+
+	def tearDown(self):
+		logging.disable(logging.NOTSET)
+		shutil.rmtree(self.dir)
+
+	def assertTablesEqual(self, first, second):
+		for name in JobTable.COLUMNS:
+			self.assertTrue(np.array_equal(getattr(first, name),
+						       getattr(second, name)), name)
+
+	def test_save_load(self):
+		table = _make_table(100)
+		filename = os.path.join(self.dir, 'table.npy')
+		table.save(filename)
+		self.assertEqual(os.listdir(self.dir), ['table.npy'])
+
+		loaded = JobTable.load(filename)
+		self.assertTablesEqual(loaded, table)
+		self.assertEqual(sorted(loaded.users),
+				 sorted(np.unique(table.user_id).tolist()))
+		# the file is mapped read only
+		self.assertTrue(_mapped(loaded.submit))
+		with self.assertRaises(ValueError):
+			loaded.submit[0] = 1
+
+	def test_take_and_sort(self):
+		table = _make_table(100)
+		part = table.take(slice(10, 20))
+		self.assertTrue(np.may_share_memory(part.ID, table.ID))
+		self.assertTablesEqual(part, table.take(np.arange(10, 20)))
+
+		ordered = table.sort_by_submit()
+		self.assertTrue((np.diff(ordered.submit) >= 0).all())
+		# the jobs submitted at the same time keep the order
+		for t in np.unique(table.submit):
+			self.assertTrue(np.array_equal(
+				ordered.ID[ordered.submit == t],
+				table.ID[table.submit == t]))
+
+	def test_iter_jobs(self):
+		table = _make_table(25)
+		table.CHUNK = 7
+		jobs = list(table.iter_jobs())
+		self.assertEqual([job.ID for job in jobs], table.ID.tolist())
+		for i, job in enumerate(jobs):
+			self.assertIs(type(job.submit), int)
+			self.assertEqual(job.submit, table.submit[i])
+			self.assertEqual(job.time_limit, table.time_limit[i])
+			self.assertIs(job.user, table.users[table.user_id[i]])
+			self.assertFalse(job.started)
+
+	def test_prepare_jobs_cache(self):
+		workload = os.path.join(self.dir, 'trace.swf')
+		with open(workload, 'w') as f:
+			f.write('; test\n')
+			for i in xrange(1, 51):
+				# the time limit is below the run time for some jobs
+				f.write('{} {} 0 {} 2 -1 -1 2 {} -1 1 {} 1 -1 1 1 -1 -1\n'
+					.format(i, 51 - i, 100 + i, 90 + 3 * i, i % 3))
+		sim_conf = _Settings(cache=os.path.join(self.dir, 'cache'),
+				     serial=0)
+		part_conf = _Settings(submitter=FromWorkloadSubmitter(None))
+
+		parsed, key = main.prepare_jobs(workload, sim_conf, part_conf)
+		self.assertEqual(os.listdir(sim_conf.cache), [key + '.npy'])
+		self.assertTrue((np.diff(parsed.submit) >= 0).all())
+		self.assertTrue((parsed.run_time <= parsed.time_limit).all())
+
+		loaded, loaded_key = main.prepare_jobs(workload, sim_conf,
+						       part_conf)
+		self.assertEqual(loaded_key, key)
+		self.assertTrue(_mapped(loaded.ID))
+		self.assertTablesEqual(loaded, parsed)
+
+		# a different content is a different cached file
+		with open(workload, 'a') as f:
+			f.write('51 60 0 10 1 -1 -1 1 10 -1 1 1 1 -1 1 1 -1 -1\n')
+		changed, changed_key = main.prepare_jobs(workload, sim_conf,
+							 part_conf)
+		self.assertNotEqual(changed_key, key)
+
+		# the code preparing the jobs is a part of the key
+		part_conf.submitter = _ChangedSubmitter(None)
+		_, code_changed_key = main.prepare_jobs(workload, sim_conf,
+							part_conf)
+		self.assertNotEqual(code_changed_key, changed_key)
+		self.assertEqual(len(changed), len(parsed) + 1)
+
+	def test_block_users_order(self):
+		# the IDs collide in a small dictionary, so its order
+		# depends on the order in which they are added
+		user_ids = [9, 1, 9, 17, 1, 25]
+		users = {uid: User(uid) for uid in user_ids}
+		count = len(user_ids)
+		table = JobTable(users, ID=np.arange(1, count + 1),
+				 submit=np.arange(count),
+				 run_time=np.ones(count, dtype=int),
+				 proc=np.ones(count, dtype=int),
+				 time_limit=np.ones(count, dtype=int),
+				 user_id=np.array(user_ids))
+		block = main.Block(table, {'left': 0, 'first': 0, 'last': 5,
+					   'right': 5}, 100, 0)
+		expected = {}
+		for job in table.iter_jobs():
+			expected[job.user.ID] = job.user
+		self.assertEqual(block.users, expected)
+		self.assertEqual(list(block.users), list(expected))
+		self.assertNotEqual(list(expected), sorted(expected))
+
+
+if __name__ == '__main__':
+	unittest.main()
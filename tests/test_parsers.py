@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from core.parsers import ICMParser, SWFParser
+
+
+def _swf_line(job_id, submit, run_time, proc, user_id, extra=0):
+	fields = [job_id, submit, 0, run_time, proc, -1, -1, proc,
+		  run_time, -1, 1, user_id, 1, -1, 1, 1, -1, -1]
+	return ' '.join(map(str, fields + [0] * extra)) + '\n'
+
+
+class SWFParserTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		logging.disable(logging.INFO)
+
+	def tearDown(self):
+		logging.disable(logging.NOTSET)
+		shutil.rmtree(self.dir)
+
+	def parse(self, lines):
+		filename = os.path.join(self.dir, 'trace.swf')
+		with open(filename, 'w') as f:
+			f.write('; comment\n')
+			f.writelines(lines)
+		jobs, users = SWFParser().parse_workload(filename, 0)
+		return jobs
+
+	def assertJobs(self, jobs, expected):
+		"""
+		Compare with the <ID, submit, run time, CPUs, user ID> tuples.
+		"""
+		rows = zip(jobs.ID.tolist(), jobs.submit.tolist(),
+			   jobs.run_time.tolist(), jobs.proc.tolist(),
+			   jobs.user_id.tolist())
+		self.assertEqual(rows, expected)
+
+	def test_chunk(self):
+		lines = [_swf_line(i, 10 * i, 100 + i, 2, i % 3)
+			 for i in xrange(1, 6)]
+		self.assertJobs(self.parse(lines),
+				[(i, 10 * i, 100 + i, 2, i % 3)
+				 for i in xrange(1, 6)])
+
+	def test_different_widths(self):
+		# the total number of fields is the same as for equal widths
+		lines = [_swf_line(10, 0, 100, 1, 1),
+			 _swf_line(20, 5, 200, 2, 2)[:-4] + '\n',
+			 _swf_line(30, 9, 300, 4, 3, extra=1)]
+		self.assertEqual(sum(len(line.split()) for line in lines),
+				 3 * 18)
+		self.assertJobs(self.parse(lines),
+				[(10, 0, 100, 1, 1), (20, 5, 200, 2, 2),
+				 (30, 9, 300, 4, 3)])
+
+	def test_float_field(self):
+		# PIK-IPLEX trace uses float in field #6
+		lines = [_swf_line(i, i, 100, 1, 1).replace(' -1 ', ' 0.5 ', 1)
+			 for i in xrange(1, 4)]
+		self.assertEqual(lines[0].split()[5], '0.5')
+		self.assertJobs(self.parse(lines),
+				[(i, i, 100, 1, 1) for i in xrange(1, 4)])
+
+	def test_float_field_fallback(self):
+		# a different width makes the float parsed line by line
+		lines = [_swf_line(1, 0, 100, 1, 1).replace(' -1 ', ' 0.5 ', 1),
+			 _swf_line(2, 1, 100, 1, 1, extra=2)]
+		self.assertJobs(self.parse(lines),
+				[(1, 0, 100, 1, 1), (2, 1, 100, 1, 1)])
+
+	def test_float_used_field(self):
+		lines = [_swf_line(1, 0, 100, 1, 1),
+			 _swf_line(2, 0, 100, 1, 1).replace(' 100 ', ' 1.5 ', 1)]
+		self.assertRaises(ValueError, self.parse, lines)
+
+
+def _strptime_stamp(time_str):
+	# the conversion used before the hour prefix cache
+	return int(time.mktime(time.strptime(time_str, '%Y-%m-%dT%H:%M:%S')))
+
+
+def _timedelta_seconds(delta_str):
+	# the conversion used before the integer arithmetic
+	days, rest = delta_str.split('-') if '-' in delta_str else (0, delta_str)
+	t = map(int, rest.split(':'))
+	return timedelta(days=int(days), hours=t[0], minutes=t[1],
+			 seconds=t[2]).total_seconds()
+
+
+def _icm_line(job_id, user, submit, run_time, time_limit, proc):
+	fields = [''] * 22
+	fields[0], fields[2], fields[4] = str(job_id), user, submit
+	fields[7], fields[8], fields[11] = run_time, time_limit, str(proc)
+	return '|'.join(fields) + '\n'
+
+
+class ICMParserTest(unittest.TestCase):
+	"""
+	Compare the conversions with the strptime and timedelta ones,
+	in a time zone with the DST changes.
+	"""
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.tz = os.environ.get('TZ')
+		os.environ['TZ'] = 'Europe/Warsaw'
+		time.tzset()
+		logging.disable(logging.INFO)
+
+	def tearDown(self):
+		logging.disable(logging.NOTSET)
+		if self.tz is None:
+			del os.environ['TZ']
+		else:
+			os.environ['TZ'] = self.tz
+		time.tzset()
+		shutil.rmtree(self.dir)
+
+	def test_time_stamps(self):
+		rand = random.Random(0)
+		parser = ICMParser()
+		# the DST starts at 2:00 and ends at 3:00 on these days
+		for day in ('2015-03-29', '2015-10-25', '2015-06-15'):
+			for hour in xrange(24):
+				for minute in xrange(0, 60, 7):
+					time_str = '{}T{:02}:{:02}:{:02}'.format(
+						day, hour, minute, rand.randint(0, 59))
+					self.assertEqual(
+						parser._from_time_str(time_str),
+						_strptime_stamp(time_str), time_str)
+		# an hour is missing in the spring
+		self.assertEqual(parser._from_time_str('2015-03-29T03:00:00') -
+				 parser._from_time_str('2015-03-29T01:59:59'), 1)
+
+	def test_durations(self):
+		parser = ICMParser()
+		for delta_str in ('00:00:00', '12:34:56', '99:59:59',
+				  '1-00:00:01', '10-23:59:59', '365-01:02:03'):
+			self.assertEqual(parser._from_delta_str(delta_str),
+					 _timedelta_seconds(delta_str), delta_str)
+
+	def test_parse_workload(self):
+		filename = os.path.join(self.dir, 'trace.icm')
+		with open(filename, 'w') as f:
+			f.write('header|with|few|fields\n')
+			f.write(_icm_line(7, 'bob', '2015-10-25T02:30:00',
+					  '01:00:00', '1-00:00:00', 4))
+			f.write(_icm_line(8, 'alice', '2015-10-25T02:30:10',
+					  '00:00:20', '00:10:00', 1))
+			f.write(_icm_line(9, 'bob', '2015-10-25T03:00:00',
+					  '2-00:00:00', '3-00:00:00', 2))
+		jobs, users = ICMParser().parse_workload(filename, 0)
+		self.assertEqual(jobs.ID.tolist(), [7, 8, 9])
+		# the user IDs are given in the order of appearance
+		self.assertEqual(jobs.user_id.tolist(), [1, 2, 1])
+		self.assertEqual(jobs.submit.tolist(), [
+			_strptime_stamp('2015-10-25T02:30:00'),
+			_strptime_stamp('2015-10-25T02:30:10'),
+			_strptime_stamp('2015-10-25T03:00:00')])
+		self.assertEqual(jobs.run_time.tolist(), [3600, 20, 2 * 86400])
+		self.assertEqual(jobs.time_limit.tolist(),
+				 [86400, 600, 3 * 86400])
+		self.assertEqual(jobs.proc.tolist(), [4, 1, 2])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+import main
+from parts import settings
+
+
+class _Block(object):
+
+	def __init__(self, indexes, core_period):
+		self.indexes = indexes
+		self.core_period = core_period
+
+
+class _Fairshare(object):
+	pass
+
+
+class _OStrich(object):
+	pass
+
+
+def _write_workload(filename, count):
+	rand = random.Random(0)
+	submit = 0
+	with open(filename, 'w') as f:
+		f.write('; test\n')
+		for i in xrange(1, count + 1):
+			submit += rand.choice([0, 10, 100, 1000])
+			run_time = rand.randint(10, 5000)
+			proc = rand.choice([1, 2, 4, 8, 16])
+			f.write('{} {} 0 {} {} -1 -1 {} {} -1 1 {} 1 -1 1 1 -1 -1\n'
+				.format(i, submit, run_time, proc, proc,
+					run_time, rand.randint(1, 10)))
+
+
+class ResultCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.args = {temp.name: temp.default for temp in
+			     settings.sim_templates + settings.alg_templates +
+			     settings.part_templates}
+		self.args.update(share_file=os.path.join(self.dir, 'shares.txt'))
+		with open(self.args['share_file'], 'w') as f:
+			f.write('1 1\n')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def key(self, **kwargs):
+		args = dict(self.args, **kwargs)
+		return main.result_key('workload', _Block((0, 0, 9, 9), (0, 100)),
+				       64, _Fairshare(), args)
+
+	def test_result_key(self):
+		key = self.key()
+		self.assertEqual(self.key(), key)
+		# the simulation settings don't change the result
+		self.assertEqual(self.key(title='other', output='other'), key)
+		self.assertNotEqual(self.key(decay=2), key)
+		self.assertNotEqual(self.key(manager='TreeManager'), key)
+		self.assertNotEqual(main.result_key(
+			'workload', _Block((0, 0, 9, 9), (0, 100)),
+			32, _Fairshare(), self.args), key)
+		self.assertNotEqual(main.result_key(
+			'workload', _Block((0, 1, 9, 9), (0, 100)),
+			64, _Fairshare(), self.args), key)
+		self.assertNotEqual(main.result_key(
+			'workload', _Block((0, 0, 9, 9), (0, 100)),
+			64, _OStrich(), self.args), key)
+		self.assertNotEqual(main.result_key(
+			'other', _Block((0, 0, 9, 9), (0, 100)),
+			64, _Fairshare(), self.args), key)
+
+		with open(self.args['share_file'], 'w') as f:
+			f.write('1 2\n')
+		self.assertNotEqual(self.key(), key)
+
+	def test_code_key_directory(self):
+		key = main.code_key()
+		cwd = os.getcwd()
+		os.chdir(self.dir)
+		try:
+			main.CODE_KEY = None
+			# the same files are hashed from any directory
+			self.assertEqual(main.code_key(), key)
+		finally:
+			os.chdir(cwd)
+
+	def test_load_missing_result(self):
+		self.assertIsNone(main.load_result(os.path.join(self.dir, 'x')))
+
+	def test_cache_results_off_by_default(self):
+		self.assertFalse(self.args['cache_results'])
+
+	def simulate(self, title, **kwargs):
+		"""
+		Run a single block simulation and return the result records.
+		"""
+		args = dict(self.args, title=title, **kwargs)
+		stdout = sys.stdout
+		sys.stdout = StringIO()
+		try:
+			main.run(os.path.join(self.dir, 'trace.swf'), args)
+		finally:
+			sys.stdout = stdout
+		[filename] = glob.glob(os.path.join(self.dir, 'out',
+						    title + '-*'))
+		with open(filename) as f:
+			# skip the header with the arguments and the start time
+			return f.readlines()[3:]
+
+	def test_reuse_results(self):
+		_write_workload(os.path.join(self.dir, 'trace.swf'), 200)
+		os.mkdir(os.path.join(self.dir, 'out'))
+		cache = os.path.join(self.dir, 'cache')
+		self.args.update(schedulers=['Fairshare'], cpu_count=64,
+				 output=os.path.join(self.dir, 'out'),
+				 cache=cache)
+
+		first = self.simulate('first')
+		# only the prepared workload is cached by default
+		self.assertEqual(len(os.listdir(cache)), 1)
+
+		cached = self.simulate('cached', cache_results=True)
+		# the simulation time in the statistics differs
+		self.assertEqual(cached[:-1], first[:-1])
+		self.assertTrue(first[-1].startswith('BLOCK END'))
+		results = sorted(glob.glob(os.path.join(cache, '*.diag')))
+		self.assertEqual(len(results), 1)
+
+		os.utime(results[0], (0, 0))
+		self.assertEqual(self.simulate('reused', cache_results=True),
+				 cached)
+		# the result was loaded, not simulated again
+		self.assertEqual(os.path.getmtime(results[0]), 0)
+
+		self.simulate('changed', cache_results=True, decay=2)
+		self.assertEqual(len(glob.glob(os.path.join(cache, '*.diag'))), 2)
+
+
+if __name__ == '__main__':
+	unittest.main()
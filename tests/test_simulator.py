@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import random
+import unittest
+from core.simulator import PriorityQueue
+
+
+class PriorityQueueTest(unittest.TestCase):
+	"""
+	Compare the indexed heap with a dictionary of the queued events.
+	"""
+
+	def test_random_operations(self):
+		rand = random.Random(0)
+		pq = PriorityQueue()
+		ref = {}  # <event, entity> -> <time, event, order>
+		order = 0
+		updates = 0
+
+		for _ in xrange(50000):
+			op = rand.random()
+			event, entity = rand.randint(1, 5), rand.randint(0, 40)
+			if op < 0.5:
+				time = rand.randint(0, 100)
+				if (event, entity) in ref:
+					updates += 1
+				pq.add(time, event, entity)
+				# an updated event is ordered like a new one
+				ref[event, entity] = (time, event, order)
+				order += 1
+			elif op < 0.7:
+				pq.remove(event, entity)
+				ref.pop((event, entity), None)
+			elif ref:
+				key = min(ref, key=ref.get)
+				first = (ref.pop(key)[0],) + key
+				self.assertEqual(pq.peek(), first)
+				self.assertEqual(pq.pop(), first)
+			else:
+				self.assertRaises(KeyError, pq.peek)
+				self.assertRaises(KeyError, pq.pop)
+			self.assertEqual(pq.empty(), not ref)
+
+		while ref:
+			key = min(ref, key=ref.get)
+			self.assertEqual(pq.pop(), (ref.pop(key)[0],) + key)
+		self.assertTrue(pq.empty())
+		self.assertEqual(pq.updates, updates)
+
+	def test_remove_missing(self):
+		pq = PriorityQueue()
+		pq.add(5, 1, 'a')
+		pq.remove(2, 'a')
+		pq.remove(1, 'b')
+		self.assertEqual(pq.pop(), (5, 1, 'a'))
+		pq.remove(1, 'a')
+		self.assertTrue(pq.empty())
+
+	def test_update_keeps_one_entry(self):
+		pq = PriorityQueue()
+		pq.add(10, 1, 'a')
+		pq.add(20, 1, 'b')
+		pq.add(30, 1, 'a')
+		pq.add(5, 1, 'b')
+		self.assertEqual(pq.max_size, 2)
+		self.assertEqual(pq.pop(), (5, 1, 'b'))
+		self.assertEqual(pq.pop(), (30, 1, 'a'))
+		self.assertTrue(pq.empty())
+
+
+if __name__ == '__main__':
+	unittest.main()
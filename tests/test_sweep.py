@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from ast import literal_eval
+from StringIO import StringIO
+import main
+from parts import settings
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+class SweepTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.args = {temp.name: temp.default for temp in
+			     settings.sim_templates + settings.alg_templates +
+			     settings.part_templates}
+		self.args.update(title='sweep', output=self.dir, cache='',
+				 submitter='FromWorkloadSubmitter')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def points(self, *grid):
+		"""
+		Return the simulations of the sweep without running them.
+		"""
+		points = []
+		simulate = main.simulate
+		main.simulate = lambda workload, args: points.extend(args)
+		try:
+			main.sweep('workload', dict(self.args, grid=list(grid)))
+		finally:
+			main.simulate = simulate
+		return points
+
+	def test_grid(self):
+		points = self.points(['decay', '2', '5'],
+				     ['schedulers', 'Fairshare', 'OStrich'],
+				     ['bf_window', '6'])
+		self.assertEqual([args['title'] for args in points],
+				 ['sweep-p0', 'sweep-p1', 'sweep-p2', 'sweep-p3'])
+		# a list setting gets a single element in each simulation
+		self.assertEqual([(args['decay'], args['schedulers'],
+				   args['bf_window']) for args in points],
+				 [(2, ['Fairshare'], 6), (2, ['OStrich'], 6),
+				  (5, ['Fairshare'], 6), (5, ['OStrich'], 6)])
+		for args in points:
+			self.assertNotIn('grid', args)
+			self.assertEqual(args['output'], self.dir)
+
+	def test_invalid_grid(self):
+		for name in main.WORKLOAD_SETTINGS:
+			with self.assertRaisesRegexp(Exception, 'whole sweep'):
+				self.points([name, '1'])
+		for name in ('title', 'unknown'):
+			with self.assertRaisesRegexp(Exception, 'invalid grid'):
+				self.points([name, '1'])
+
+	def test_different_workload_settings(self):
+		points = [dict(self.args), dict(self.args, serial=8)]
+		with self.assertRaisesRegexp(Exception, 'different serial'):
+			main.simulate('workload', points)
+
+	def test_result_files(self):
+		args = dict(self.args, schedulers=['Fairshare'],
+			    grid=[['decay', '1', '3']])
+		stdout = sys.stdout
+		sys.stdout = StringIO()
+		try:
+			main.sweep(os.path.join(DATA_DIR, 'golden.swf'), args)
+		finally:
+			sys.stdout = stdout
+
+		for num, decay in enumerate([1, 3]):
+			title = 'sweep-p{}'.format(num)
+			[filename] = glob.glob(os.path.join(
+				self.dir, title + '-Fairshare-*'))
+			with open(filename) as f:
+				lines = f.readlines()
+			# the arguments of the simulation, for `config --recreate`
+			values = literal_eval(lines[1])
+			self.assertEqual(values['title'], title)
+			self.assertEqual(values['decay'], decay)
+			self.assertTrue(lines[-1].startswith('BLOCK END'))
+
+
+if __name__ == '__main__':
+	unittest.main()